@@ -90,6 +90,7 @@ class BrightnessApp:
         self.preview_tk = None
         self.arr = None
         self.params = None
+        self.geometry = None
 
         self.root.bind("<Configure>", self.on_resize)
         self._debounce_id = None
@@ -182,7 +183,9 @@ class BrightnessApp:
                 "perspective": bool(self.perspective_var.get()),
             }
 
-            arr = compute_brightness(params)
+            # геометрия сферы пересчитывается только при изменении экрана, сферы или камеры
+            self.geometry = compute_geometry(params, self.geometry)
+            arr = compute_brightness(params, self.geometry)
             self.arr = arr
             self.params = params
 
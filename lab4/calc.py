@@ -1,5 +1,8 @@
 import numpy as np
 
+# число источников, обрабатываемых за один проход
+LIGHT_BLOCK = 8
+
 def ray_sphere_intersection_np(ray_origin, ray_dir, center, radius):
     oc = ray_origin - center
     b = np.sum(ray_dir * oc, axis=-1)
@@ -10,13 +13,74 @@ def ray_sphere_intersection_np(ray_origin, ray_dir, center, radius):
     return hit, t
 
 
-def compute_brightness(params):
-    H, W = params["H"], params["W"]
-    Hres, Wres = params["Hres"], params["Wres"]
+def geometry_key(params):
+    return (
+        params["H"],
+        params["W"],
+        params["Hres"],
+        params["Wres"],
+        tuple(params["sphere_center"]),
+        params["sphere_radius"],
+        params["observer_z"],
+    )
+
+
+class SphereGeometry:
+    # все, что зависит только от экрана, сферы и наблюдателя: при изменении источников
+    # или материала пересчитывается только освещение
+    def __init__(self, params):
+        self.key = geometry_key(params)
+        H, W, Hres, Wres, (xC, yC, zC), R, zO = self.key
+        self.shape = (Hres, Wres)
+
+        xs = np.linspace(-W / 2.0, W / 2.0, Wres)
+        ys = np.linspace(-H / 2.0, H / 2.0, Hres)
+
+        # маска строится по строке и столбцу координат без полной сетки
+        dx = xs[None, :] - xC
+        dy = ys[:, None] - yC
+        inside = dx * dx + dy * dy <= R * R
+
+        # дальше считаются только пиксели внутри сферы, собранные в одномерные массивы:
+        # объем работы пропорционален площади проекции сферы, а не Hres*Wres
+        self.iy, self.ix = np.nonzero(inside)
+        xv = xs[self.ix]
+        yv = ys[self.iy]
+        dx = xv - xC
+        dy = yv - yC
+
+        # координата z на сфере
+        z_sphere = zC + np.sqrt(np.maximum(R * R - dx * dx - dy * dy, 0.0))
+
+        # вектор нормали
+        nx = dx / R
+        ny = dy / R
+        nz = (z_sphere - zC) / R
 
-    xC, yC, zC = params["sphere_center"]
-    R = params["sphere_radius"]
-    zO = params["observer_z"]
+        # формируем вектора нормалей
+        self.N = np.stack([nx, ny, nz], axis=-1)[:, None, :]
+
+        # вектор взгляда
+        V = np.stack([np.zeros_like(xv), np.zeros_like(yv), zO - z_sphere], axis=-1)
+        V /= np.linalg.norm(V, axis=-1, keepdims=True)
+        self.V = V[:, None, :]
+
+        # точки на сфере
+        self.P = np.stack([xv, yv, z_sphere], axis=-1)[:, None, :]
+
+    @property
+    def count(self):
+        return len(self.ix)
+
+
+def compute_geometry(params, geometry=None):
+    # переданная геометрия переиспользуется, если экран, сфера и наблюдатель не изменились
+    if geometry is not None and geometry.key == geometry_key(params):
+        return geometry
+    return SphereGeometry(params)
+
+
+def compute_brightness(params, geometry=None):
     I0 = params["I0"]
     k_diff = params["k_diff"]
     k_spec = params["k_spec"]
@@ -24,65 +88,75 @@ def compute_brightness(params):
     lights = params["light_sources"]
     perspective = params["perspective"]
 
-    xs = np.linspace(-W / 2.0, W / 2.0, Wres)
-    ys = np.linspace(-H / 2.0, H / 2.0, Hres)
-    xv, yv = np.meshgrid(xs, ys, indexing="xy") 
-
-    dx = xv - xC
-    dy = yv - yC
-    inside = dx * dx + dy * dy <= R * R
-    img = np.zeros((Hres, Wres), dtype=np.float32)
+    geometry = compute_geometry(params, geometry)
+    img = np.zeros(geometry.shape, dtype=np.float32)
     
     # если все за пределами или источников нет возвращаем сразу нули
-    if not np.any(inside) or len(lights) == 0:
+    if geometry.count == 0 or len(lights) == 0:
         return img
 
-    # координата z на сфере
-    z_sphere = zC + np.sqrt(np.maximum(R * R - dx * dx - dy * dy, 0.0))
-    
-    # вектор нормали
-    nx = (xv - xC) / R
-    ny = (yv - yC) / R
-    nz = (z_sphere - zC) / R
-
-    # формируем вектора нормалей
-    N = np.stack([nx, ny, nz], axis=-1)[..., None, :]
-
-    # вектор взгляда
-    V = np.stack([np.zeros_like(xv), np.zeros_like(yv), zO - z_sphere], axis=-1)
-    V /= np.linalg.norm(V, axis=-1, keepdims=True)
+    N, P, Vtile = geometry.N, geometry.P, geometry.V
 
     # массив векторов вида (x, y, z) с координатами источников света
     lights_arr = np.array(lights, dtype=np.float32) 
-    
-    # формируем вектор от точки P (точка на сфере) к источнику 
-    Lvec = lights_arr[None, None, :, :] - np.stack(
-        [xv[..., None], yv[..., None], z_sphere[..., None]], axis=-1
-    )
-    
-    Lnorm = np.linalg.norm(Lvec, axis=-1, keepdims=True)
-    
-    # избегаем деления на 0
-    Ldir = Lvec / np.maximum(Lnorm, 1e-9)
 
-    # рассчитываем диффузию в каждой точке от каждого источника
-    # векторное произведение представили в виде суммы произведения компонентов
-    diff = np.maximum(np.sum(N * Ldir, axis=-1), 0.0) 
+    # источники обрабатываются блоками по light_block штук, промежуточные массивы
+    # выделяются один раз на блок и переиспользуются, поэтому память не растет с числом источников
+    block = max(1, min(int(params.get("light_block", LIGHT_BLOCK)), len(lights_arr)))
+    count = geometry.count
+    Lbuf = np.empty((count, block, 3))
+    Hbuf = np.empty((count, block, 3))
+    normbuf = np.empty((count, block, 1))
+    diffbuf = np.empty((count, block))
+    specbuf = np.empty((count, block))
+    total = np.empty(count)
+    brightness = np.zeros(count, dtype=np.float32)
 
-    Vtile = V[..., None, :]
-    
-    # рассчитываем полувектор
-    Hvec = Ldir + Vtile
-    Hvec /= np.maximum(np.linalg.norm(Hvec, axis=-1, keepdims=True), 1e-9)
-    
-    # рассчитываем спектральную составляющую в каждой точке от каждого источника
-    # векторное произведение представили в виде суммы произведения компонентов
-    spec = np.maximum(np.sum(N * Hvec, axis=-1), 0.0) ** shininess  
-
-    # для каждого источника вычисляем яркость и суммируем
-    # яркость считается по модели Блинна-Фонга
-    total = np.sum(I0 * (k_diff * diff + k_spec * spec), axis=-1)
-    img += total
-    img[~inside] = 0.0
+    for start in range(0, len(lights_arr), block):
+        n = min(block, len(lights_arr) - start)
+        Ldir, Hvec, norm = Lbuf[:, :n], Hbuf[:, :n], normbuf[:, :n]
+        diff, spec = diffbuf[:, :n], specbuf[:, :n]
+
+        # формируем вектор от точки P (точка на сфере) к источнику 
+        np.subtract(lights_arr[None, start:start + n, :], P, out=Ldir)
+
+        # нормируем, избегая деления на 0; Hvec пока служит временным буфером
+        np.multiply(Ldir, Ldir, out=Hvec)
+        np.sum(Hvec, axis=-1, keepdims=True, out=norm)
+        np.sqrt(norm, out=norm)
+        np.maximum(norm, 1e-9, out=norm)
+        np.divide(Ldir, norm, out=Ldir)
+
+        # рассчитываем диффузию в каждой точке от каждого источника
+        # векторное произведение представили в виде суммы произведения компонентов
+        np.multiply(N, Ldir, out=Hvec)
+        np.sum(Hvec, axis=-1, out=diff)
+        np.maximum(diff, 0.0, out=diff)
+
+        # рассчитываем полувектор; Ldir больше не нужен и служит временным буфером
+        np.add(Ldir, Vtile, out=Hvec)
+        np.multiply(Hvec, Hvec, out=Ldir)
+        np.sum(Ldir, axis=-1, keepdims=True, out=norm)
+        np.sqrt(norm, out=norm)
+        np.maximum(norm, 1e-9, out=norm)
+        np.divide(Hvec, norm, out=Hvec)
+
+        # рассчитываем спектральную составляющую в каждой точке от каждого источника
+        np.multiply(N, Hvec, out=Ldir)
+        np.sum(Ldir, axis=-1, out=spec)
+        np.maximum(spec, 0.0, out=spec)
+        np.power(spec, shininess, out=spec)
+
+        # для каждого источника вычисляем яркость и суммируем
+        # яркость считается по модели Блинна-Фонга
+        np.multiply(diff, k_diff, out=diff)
+        np.multiply(spec, k_spec, out=spec)
+        np.add(diff, spec, out=diff)
+        np.multiply(diff, I0, out=diff)
+        np.sum(diff, axis=-1, out=total)
+        brightness += total
+
+    # результаты возвращаются на свои места в изображении, пиксели вне сферы остаются нулевыми
+    img[geometry.iy, geometry.ix] = brightness
     
     return img
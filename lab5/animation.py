@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+from renderer import RendererComponent
+from scene_file import load_scene
+
+CAMERA_KEYS = ('azimuth', 'elevation', 'distance')
+LIGHT_KEYS = {'pos': 'light_pos', 'color': 'light_color', 'i0': 'light_i0', 'radius': 'light_radius'}
+DEFAULT_QUEUE_SIZE = 4
+
+
+def flatten_keyframe(keyframe):
+    params = {}
+    for key in CAMERA_KEYS:
+        if key in keyframe.get('camera', {}):
+            params[('camera', key)] = np.asarray(keyframe['camera'][key], dtype=np.float64)
+    for light in keyframe.get('lights', []):
+        for key in LIGHT_KEYS:
+            if key in light:
+                params[('light', int(light['index']), key)] = np.asarray(light[key], dtype=np.float64)
+    return params
+
+
+def parse_animation(data):
+    try:
+        frames = int(data['frames'])
+        keyframes = sorted(((int(keyframe['frame']), flatten_keyframe(keyframe)) for keyframe in data['keyframes']),
+                           key=lambda item: item[0])
+    except KeyError as e:
+        raise ValueError(f"отсутствует поле {e}") from None
+    except TypeError as e:
+        raise ValueError(str(e)) from None
+    if frames < 1:
+        raise ValueError("число кадров должно быть положительным")
+
+    # для каждого параметра — свои ключевые кадры, между ними линейная интерполяция
+    tracks = {}
+    for frame, params in keyframes:
+        for key, value in params.items():
+            tracks.setdefault(key, []).append((frame, value))
+    return frames, tracks
+
+
+def interpolate(track, frame):
+    frames = [key_frame for key_frame, _ in track]
+    values = np.array([value for _, value in track])
+    if values.ndim == 1:
+        return np.interp(frame, frames, values)
+    return np.array([np.interp(frame, frames, values[:, k]) for k in range(values.shape[1])])
+
+
+def orbit_view(center, azimuth, elevation, distance):
+    # камера на сфере вокруг центра сцены; azimuth=elevation=0 совпадает с видом спереди
+    azimuth = np.radians(azimuth)
+    elevation = np.radians(np.clip(elevation, -89.0, 89.0))
+    direction = np.array([np.sin(azimuth) * np.cos(elevation), np.sin(elevation), np.cos(azimuth) * np.cos(elevation)])
+    sx = np.cross([0.0, 1.0, 0.0], direction)
+    sx /= np.linalg.norm(sx)
+    sy = np.cross(direction, sx)
+    return {'eye': center + distance * direction, 'sx': sx, 'sy': sy, 'sc': center}
+
+
+def frame_state(screen_p, scene, tracks, frame):
+    scene = scene.copy()
+    camera = {}
+    for key, track in tracks.items():
+        value = interpolate(track, frame)
+        if key[0] == 'camera':
+            camera[key[1]] = float(value)
+        else:
+            _, index, name = key
+            getattr(scene, LIGHT_KEYS[name])[index] = value
+
+    # без ключей камеры рендерятся стандартные виды, иначе — одна орбитальная камера
+    if not camera:
+        return scene, None
+    view = orbit_view(scene.center(), camera.get('azimuth', 0.0), camera.get('elevation', 0.0),
+                      camera.get('distance', screen_p['zo']))
+    return scene, {'camera': view}
+
+
+def frame_paths(out_dir, frame, view_names):
+    return {view_name: os.path.join(out_dir, f"frame_{frame:05d}_{view_name}.png") for view_name in view_names}
+
+
+def write_frames(frames_queue, errors):
+    # PNG сжимаются и пишутся в отдельном потоке, очередь ограничена, чтобы кадры не копились в памяти
+    while True:
+        item = frames_queue.get()
+        if item is None:
+            return
+        for path, image in item:
+            try:
+                image.save(path + '.tmp', format='PNG')
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                errors.append(f"{path}: {e}")
+
+
+def render_animation(spec_path, out_dir, processes=None, queue_size=DEFAULT_QUEUE_SIZE, progress=None):
+    with open(spec_path, encoding='utf-8') as f:
+        data = json.load(f)
+    frames, tracks = parse_animation(data)
+    screen_p, scene = load_scene(os.path.join(os.path.dirname(spec_path), data['scene']))
+    for key in tracks:
+        if key[0] == 'light' and not 0 <= key[1] < scene.light_count:
+            raise ValueError(f"нет источника с индексом {key[1]}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    renderer = RendererComponent(processes)
+    frames_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    writer = threading.Thread(target=write_frames, args=(frames_queue, errors))
+    writer.start()
+
+    rendered = 0
+    skipped = 0
+    start = time.perf_counter()
+    try:
+        for frame in range(frames):
+            frame_scene, views = frame_state(screen_p, scene, tracks, frame)
+            view_names = list(views) if views else list(renderer.compute_views(screen_p, frame_scene))
+            paths = frame_paths(out_dir, frame, view_names)
+
+            # при повторном запуске готовые кадры не рендерятся заново
+            if all(os.path.exists(path) for path in paths.values()):
+                skipped += 1
+                continue
+
+            images, _ = renderer.render(screen_p, frame_scene, views=views)
+            frames_queue.put([(paths[view_name], image) for view_name, image in images.items()])
+            rendered += 1
+            if progress is not None:
+                progress(frame, rendered / (time.perf_counter() - start))
+    finally:
+        frames_queue.put(None)
+        writer.join()
+        renderer.close()
+
+    elapsed = time.perf_counter() - start
+    return rendered, skipped, elapsed, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Рендер последовательности кадров по ключевым кадрам камеры и источников")
+    parser.add_argument('animation', help="JSON с описанием анимации")
+    parser.add_argument('-o', '--output', default='frames', help="каталог для кадров (по умолчанию frames)")
+    parser.add_argument('-p', '--processes', type=int, default=None, help="число процессов рендера")
+    parser.add_argument('--queue', type=int, default=DEFAULT_QUEUE_SIZE, help="максимум кадров в очереди на запись")
+    args = parser.parse_args(argv)
+
+    def progress(frame, fps):
+        print(f"кадр {frame}: {fps:.2f} кадр/с")
+
+    try:
+        rendered, skipped, elapsed, errors = render_animation(args.animation, args.output, args.processes,
+                                                              args.queue, progress)
+    except (OSError, ValueError) as e:
+        print(f"ошибка: {e}", file=sys.stderr)
+        return 1
+
+    for error in errors:
+        print(f"ошибка записи {error}", file=sys.stderr)
+    fps = rendered / elapsed if elapsed > 0 else 0.0
+    print(f"Готово: {rendered} кадров за {elapsed:.2f} с ({fps:.2f} кадр/с), пропущено готовых: {skipped}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,14 @@
+import os
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, filedialog
 from screen_params import ScreenParamsComponent
 from object_manager import ObjectManagerComponent
 from renderer import RendererComponent
+from raycast import REFLECTION_DEPTH
+from render_cache import RenderCache
+from render_worker import BackgroundRenderer
 from image_display import ImageDisplayComponent
+from tonemap import save_radiance, tonemap_images
 
 class App:
     def __init__(self):
@@ -20,6 +25,23 @@ class App:
 
         ttk.Button(self.input_frame, text="Рендерить", command=self.render).grid(row=12, column=0, columnspan=4)
         ttk.Button(self.input_frame, text="Сохранить изображения", command=self.save_images).grid(row=13, column=0, columnspan=4)
+        ttk.Button(self.input_frame, text="Сохранить трассировку", command=self.save_trace).grid(row=15, column=0, columnspan=4)
+
+        self.antialias = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.input_frame, text="Сглаживание границ", variable=self.antialias).grid(row=17, column=0, columnspan=4, sticky='w')
+
+        ttk.Label(self.input_frame, text="Экспозиция (ступени):").grid(row=18, column=0, sticky='w')
+        self.exposure = tk.DoubleVar(value=0.0)
+        ttk.Scale(self.input_frame, from_=-4.0, to=4.0, variable=self.exposure,
+                  command=lambda value: self.change_exposure()).grid(row=18, column=1, columnspan=3, sticky='ew')
+        ttk.Button(self.input_frame, text="Сохранить HDR", command=self.save_hdr).grid(row=19, column=0, columnspan=4)
+
+        ttk.Label(self.input_frame, text="Глубина отражений:").grid(row=20, column=0, sticky='w')
+        self.max_depth = tk.IntVar(value=REFLECTION_DEPTH)
+        ttk.Spinbox(self.input_frame, from_=0, to=10, width=5, textvariable=self.max_depth).grid(row=20, column=1, sticky='w')
+
+        self.timing_label = ttk.Label(self.input_frame, text="", wraplength=300, justify='left')
+        self.timing_label.grid(row=16, column=0, columnspan=4, sticky='w')
 
         self.canvas = tk.Canvas(self.input_frame)
         self.canvas.grid(row=14, column=0, columnspan=4, sticky='nsew')
@@ -38,7 +60,7 @@ class App:
         self.image_frame = ttk.Frame(self.root)
         self.image_frame.grid(row=0, column=1, sticky='nsew')
 
-        self.image_display = ImageDisplayComponent(self.image_frame, self.resize_images)
+        self.image_display = ImageDisplayComponent(self.image_frame, self.resize_images, self.update_timing)
 
         self.root.columnconfigure(1, weight=1)
         self.root.rowconfigure(0, weight=1)
@@ -57,9 +79,17 @@ class App:
 
         self.root.geometry("1200x800")
 
-        self.renderer = RendererComponent()
+        self.renderer = RendererComponent(cache=RenderCache())
+        self.background = BackgroundRenderer(self.renderer)
+        self.view_images = {}
+        self.radiance = {}
+        # пока экспозицию не трогали, виды показываются с нормировкой по своему максимуму, как и при рендере
+        self.exposure_changed = False
+        self.root.after(50, self.poll_render)
 
         self.root.mainloop()
+        self.background.close()
+        self.image_display.close()
 
     def add_sphere(self):
         self.object_manager.add_sphere()
@@ -82,26 +112,89 @@ class App:
     def get_params(self):
         try:
             screen_p = self.screen_params_comp.get_params()
-            spheres = self.object_manager.get_spheres()
-            lights = self.object_manager.get_lights()
-            return screen_p, spheres, lights
+            scene = self.object_manager.get_scene()
+            return screen_p, scene
         except ValueError as e:
             tk.messagebox.showerror("Ошибка", f"Некорректное значение: {e}")
             raise
 
     def render(self):
-        screen_p, spheres, lights = self.get_params()
-        images, view_images = self.renderer.render(screen_p, spheres, lights)
-        self.image_display.update_images(images, view_images)
+        screen_p, scene = self.get_params()
+        self.view_images = {}
+        self.radiance = {}
+        self.background.submit(screen_p, scene, antialias=self.antialias.get(), max_depth=self.max_depth.get())
+        self.timing_label.config(text="Рендер...")
+
+    def poll_render(self):
+        # все пришедшие виды и проходы показываются за одно обновление
+        updated = False
+        for message in self.background.poll():
+            if message[0] == 'view':
+                _, _, view_name, image = message
+                self.view_images[view_name] = image
+                updated = True
+            elif message[0] == 'done':
+                _, _, images, view_images, profile, self.radiance = message
+                if self.exposure_changed:
+                    self.image_display.profile = profile
+                    self.apply_exposure()
+                else:
+                    self.image_display.update_images(images, view_images, profile)
+                self.update_timing()
+                updated = False
+            else:
+                tk.messagebox.showerror("Ошибка", f"Ошибка рендера: {message[2]}")
+        if updated:
+            self.image_display.update_images(dict(self.view_images), dict(self.view_images))
+        self.root.after(50, self.poll_render)
+
+    def change_exposure(self):
+        self.exposure_changed = True
+        self.apply_exposure()
+
+    def apply_exposure(self):
+        # после выбора экспозиции виды нормируются по общему максимуму; повторный рендер не нужен
+        if not self.radiance:
+            return
+        images = tonemap_images(self.radiance, self.exposure.get())
+        self.image_display.update_images(images, dict(images), self.image_display.profile)
+
+    def save_hdr(self):
+        if not self.radiance:
+            return
+        directory = filedialog.askdirectory()
+        if not directory:
+            return
+        # нумерация как у save_images: ранее сохраненные файлы не перезаписываются
+        number = 1
+        while any(os.path.exists(os.path.join(directory, f"{view_name}_{number:03d}.npy")) for view_name in self.radiance):
+            number += 1
+        for view_name, radiance in self.radiance.items():
+            save_radiance(os.path.join(directory, f"{view_name}_{number:03d}.npy"), radiance)
 
     def resize_images(self):
         self.image_display.resize_images()
 
+    def update_timing(self):
+        profile = self.image_display.timing_profile()
+        if profile is not None:
+            self.timing_label.config(text=profile.summary())
+
     def on_resize(self, event):
         self.resize_images()
 
     def save_images(self):
-        self.image_display.save_images()
+        directory = filedialog.askdirectory()
+        if directory:
+            self.image_display.save_images(directory)
+
+    def save_trace(self):
+        profile = self.image_display.timing_profile()
+        if profile is None:
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON", "*.json")])
+        if path:
+            profile.dump(path)
 
 
 if __name__ == "__main__":
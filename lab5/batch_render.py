@@ -0,0 +1,145 @@
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Pool
+from raycast import REFLECTION_DEPTH
+from renderer import RendererComponent
+from render_farm import AUTHKEY_ENV, load_authkey
+from render_cache import RenderCache
+from scene_file import load_scene
+from stream_render import render_streaming
+from tonemap import save_radiance, tonemap_images
+
+
+def find_scenes(paths):
+    scene_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            scene_paths += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.json'))
+        else:
+            scene_paths.append(path)
+    return scene_paths
+
+
+def render_scene(renderer, scene_path, out_dir, trace=False, antialias=False, memory_budget=None, hdr=False,
+                 exposure=None, max_depth=REFLECTION_DEPTH, light_samples=0):
+    screen_p, scene = load_scene(scene_path)
+    stem = os.path.splitext(os.path.basename(scene_path))[0]
+
+    if memory_budget:
+        # потоковый режим для больших разрешений: память ограничена бюджетом, сглаживание не применяется
+        written = render_streaming(renderer, screen_p, scene, out_dir, stem, memory_budget, keep_hdr=hdr,
+                                   max_depth=max_depth, light_samples=light_samples)
+    else:
+        images, _ = renderer.render(screen_p, scene, antialias=antialias, max_depth=max_depth,
+                                    light_samples=light_samples)
+        if hdr or exposure is not None:
+            radiances = renderer.copy_radiance()
+        if exposure is not None:
+            # общая нормировка по всем видам вместо нормировки каждого вида по своему максимуму
+            images = tonemap_images(radiances, exposure)
+        written = []
+        for view_name, img in images.items():
+            path = os.path.join(out_dir, f"{stem}_{view_name}.png")
+            img.save(path)
+            written.append(path)
+            if hdr:
+                path = os.path.join(out_dir, f"{stem}_{view_name}.npy")
+                save_radiance(path, radiances[view_name])
+                written.append(path)
+
+    if trace:
+        path = os.path.join(out_dir, f"{stem}_trace.json")
+        renderer.profile.dump(path)
+        written.append(path)
+    return written
+
+
+def render_job(job):
+    scene_path, out_dir, processes, cache_dir, farm, farm_key, options = job
+    renderer = RendererComponent(processes, RenderCache(cache_dir) if cache_dir else None, farm, farm_key)
+    try:
+        return scene_path, render_scene(renderer, scene_path, out_dir, **options), None
+    except (OSError, ValueError) as e:
+        return scene_path, [], str(e)
+    finally:
+        renderer.close()
+
+
+def render_batch(scene_paths, out_dir, jobs=None, processes=None, cache_dir=None, farm=None, farm_key=None,
+                 **options):
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = max(1, min(jobs or os.cpu_count(), len(scene_paths)))
+    if farm:
+        # при работе через ферму параллелизм дают узлы, сцены идут по очереди
+        jobs = 1
+
+    if jobs == 1:
+        for scene_path in scene_paths:
+            yield render_job((scene_path, out_dir, processes, cache_dir, farm, farm_key, options))
+        return
+
+    # сцены рендерятся параллельно, каждая в своем процессе без вложенного пула
+    with Pool(processes=jobs) as pool:
+        yield from pool.imap(render_job, [(scene_path, out_dir, 0, cache_dir, None, None, options)
+                                          for scene_path in scene_paths])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный рендеринг сцен без графического интерфейса")
+    parser.add_argument('scenes', nargs='+', help="файлы сцен (.json) или каталоги с ними")
+    parser.add_argument('-o', '--output', default='renders', help="каталог для PNG (по умолчанию renders)")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="число сцен, рендерящихся параллельно")
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help="число процессов рендера одной сцены при последовательной обработке")
+    parser.add_argument('--trace', action='store_true', help="сохранить трассировку этапов рендера рядом с PNG")
+    parser.add_argument('--aa', action='store_true', help="сглаживание границ сфер и теней")
+    parser.add_argument('--depth', type=int, default=REFLECTION_DEPTH,
+                        help=f"максимальная глубина отражений (по умолчанию {REFLECTION_DEPTH}, 0 — без отражений)")
+    parser.add_argument('--light-samples', type=int, metavar='N', default=0,
+                        help="эталонная полутень: N x N выборок на протяженный источник вместо аналитической")
+    parser.add_argument('--stream', type=int, metavar='МБ', default=None,
+                        help="потоковый рендер полосами строк с бюджетом памяти в мегабайтах")
+    parser.add_argument('--hdr', action='store_true', help="сохранить линейную яркость видов в .npy рядом с PNG")
+    parser.add_argument('--exposure', type=float, default=None,
+                        help="общая нормировка видов с экспозицией в ступенях (без --stream)")
+    parser.add_argument('--cache', metavar='КАТАЛОГ', default=None,
+                        help="дисковый кэш результатов: повторный рендер той же сцены берется из него")
+    parser.add_argument('--farm', nargs='+', metavar='АДРЕС', default=None,
+                        help="адреса узлов render_farm (host:port или путь к Unix-сокету)")
+    parser.add_argument('--farm-key-file', metavar='ФАЙЛ', default=None,
+                        help=f"файл с ключом фермы (иначе переменная {AUTHKEY_ENV})")
+    args = parser.parse_args(argv)
+
+    farm_key = None
+    if args.farm:
+        try:
+            farm_key = load_authkey(args.farm_key_file)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    scene_paths = find_scenes(args.scenes)
+    if not scene_paths:
+        parser.error("не найдено ни одной сцены")
+
+    failed = 0
+    start = time.perf_counter()
+    for scene_path, written, error in render_batch(
+            scene_paths, args.output, args.jobs, args.processes, args.cache, args.farm, farm_key,
+            trace=args.trace,
+            antialias=args.aa, memory_budget=args.stream and args.stream * 2 ** 20, hdr=args.hdr,
+            exposure=args.exposure, max_depth=args.depth, light_samples=args.light_samples):
+        if error:
+            failed += 1
+            print(f"{scene_path}: ошибка: {error}", file=sys.stderr)
+        else:
+            print(f"{scene_path}: {', '.join(written)}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Готово: {len(scene_paths) - failed} из {len(scene_paths)} сцен за {elapsed:.2f} с")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from renderer import RendererComponent
+from scene import Scene
+
+VIEW_ORDER = ['front', 'side1', 'top', 'side2']
+
+PRESETS = {
+    'quick': {'resolution': [128, 256, 512], 'spheres': [1, 10, 100], 'lights': [1, 2], 'views': [1, 4]},
+    'full': {'resolution': [128, 256, 512, 1024, 2048], 'spheres': [1, 10, 100, 1000, 10000],
+             'lights': [1, 2, 4, 8], 'views': [1, 2, 4]},
+}
+
+BASE_CASE = {'resolution': 256, 'spheres': 10, 'lights': 2, 'views': 4}
+
+
+def make_scene(resolution, sphere_count, light_count, seed=0):
+    rng = np.random.default_rng(seed)
+    # сферы заполняют куб с постоянной долей объема, чтобы плотность сцены не зависела от их числа
+    half = 600.0
+    radius = half * (0.1 / sphere_count) ** (1 / 3)
+
+    screen_p = {'w_mm': 2000.0, 'h_mm': 2000.0, 'w_res': float(resolution), 'h_res': float(resolution), 'zo': 1800.0}
+    scene = Scene(
+        centers=rng.uniform(-half, half, (sphere_count, 3)),
+        radii=radius * rng.uniform(0.5, 1.0, sphere_count),
+        colors=rng.uniform(0, 1, (sphere_count, 3)),
+        kd=np.full(sphere_count, 0.8),
+        ks=np.full(sphere_count, 0.5),
+        shin=np.full(sphere_count, 32.0),
+        light_pos=rng.uniform(-3000, 3000, (light_count, 3)),
+        light_color=np.ones((light_count, 3)),
+        light_i0=np.full(light_count, 10000.0),
+    )
+    return screen_p, scene
+
+
+def build_cases(values, grid=False, base=BASE_CASE):
+    axes = list(base)
+    if grid:
+        return [dict(zip(axes, combo)) for combo in itertools.product(*(values[axis] for axis in axes))]
+
+    # по умолчанию каждая ось перебирается отдельно, остальные параметры берутся из base
+    cases = []
+    for axis in axes:
+        for value in values[axis]:
+            case = {**base, axis: value}
+            if case not in cases:
+                cases.append(case)
+    return cases
+
+
+def case_key(case):
+    return f"res={case['resolution']} spheres={case['spheres']} lights={case['lights']} views={case['views']}"
+
+
+def read_cpu_times():
+    times = []
+    with open('/proc/stat') as f:
+        for line in f:
+            if line.startswith('cpu') and line[3].isdigit():
+                fields = [int(v) for v in line.split()[1:]]
+                idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+                times.append((sum(fields), idle))
+    return times
+
+
+def cpu_utilization(before, after):
+    return [round(1.0 - (idle1 - idle0) / (total1 - total0), 3) if total1 > total0 else 0.0
+            for (total0, idle0), (total1, idle1) in zip(before, after)]
+
+
+def process_ids(renderer):
+    pids = [os.getpid()]
+    if renderer.pool.pool is not None:
+        pids += [process.pid for process in renderer.pool.pool._pool]
+    return pids
+
+
+def reset_peak_rss(pids):
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+
+
+def peak_rss_mb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total / 1024, 1)
+
+
+def run_case(renderer, case, repeats):
+    screen_p, scene = make_scene(case['resolution'], case['spheres'], case['lights'])
+    view_names = VIEW_ORDER[:case['views']]
+    renderer.pool.start()
+    pids = process_ids(renderer)
+
+    wall_times = []
+    reset_peak_rss(pids)
+    cpu_before = read_cpu_times()
+    for _ in range(repeats):
+        renderer.invalidate()
+        start = time.perf_counter()
+        renderer.render(screen_p, scene, view_names)
+        wall_times.append(time.perf_counter() - start)
+    cpu_after = read_cpu_times()
+
+    wall_time = min(wall_times)
+    primary_rays = case['resolution'] ** 2 * case['views']
+    return {
+        **case,
+        'key': case_key(case),
+        'wall_time_s': round(wall_time, 4),
+        'wall_times_s': [round(t, 4) for t in wall_times],
+        'primary_rays': primary_rays,
+        'rays_per_s': round(primary_rays / wall_time),
+        'peak_rss_mb': peak_rss_mb(pids),
+        'cpu_utilization': cpu_utilization(cpu_before, cpu_after),
+    }
+
+
+def compare(results, baseline, tolerance):
+    reference = {result['key']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        base = reference.get(result['key'])
+        if base is None:
+            continue
+        ratio = result['wall_time_s'] / base['wall_time_s']
+        status = 'РЕГРЕССИЯ' if ratio > 1 + tolerance else 'ok'
+        print(f"{result['key']}: {base['wall_time_s']:.4f} -> {result['wall_time_s']:.4f} с (x{ratio:.2f}) {status}")
+        if ratio > 1 + tolerance:
+            regressions.append(result['key'])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк RendererComponent.render",
+        epilog="Без --grid каждая ось перебирается отдельно при фиксированных остальных. Для осей, "
+               "заданных в командной строке, фиксируется первое указанное значение, для прочих — "
+               f"значение из {BASE_CASE}.")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick')
+    parser.add_argument('--resolutions', type=int, nargs='+')
+    parser.add_argument('--spheres', type=int, nargs='+')
+    parser.add_argument('--lights', type=int, nargs='+')
+    parser.add_argument('--views', type=int, nargs='+', choices=range(1, len(VIEW_ORDER) + 1))
+    parser.add_argument('--grid', action='store_true', help="перебирать все сочетания параметров")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('-o', '--output', default='benchmark.json')
+    parser.add_argument('--baseline', help="JSON прошлого запуска для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="допустимое замедление (доля)")
+    args = parser.parse_args(argv)
+
+    values = dict(PRESETS[args.preset])
+    base = dict(BASE_CASE)
+    for axis, override in (('resolution', args.resolutions), ('spheres', args.spheres),
+                           ('lights', args.lights), ('views', args.views)):
+        if override:
+            values[axis] = override
+            # остальные оси перебираются при заданном значении этой оси, а не при значении из BASE_CASE
+            base[axis] = override[0]
+
+    renderer = RendererComponent(args.processes)
+    results = []
+    try:
+        for case in build_cases(values, args.grid, base):
+            result = run_case(renderer, case, args.repeats)
+            results.append(result)
+            print(f"{result['key']}: {result['wall_time_s']:.4f} с, {result['rays_per_s']} лучей/с, "
+                  f"{result['peak_rss_mb']} МБ")
+    finally:
+        renderer.close()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'processes': renderer.pool.processes,
+            'repeats': args.repeats,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Замедление обнаружено в {len(regressions)} случаях", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import numpy as np
+from raycast import ray_sphere_intersect_np, cone_overlap_np, dot_np, norm_np
+from profiler import count
+
+LEAF_SIZE = 8
+
+
+class SphereBVH:
+    def __init__(self, centers, radii, leaf_size=LEAF_SIZE):
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        self.radii = np.asarray(radii, dtype=np.float64)
+        self.leaf_size = leaf_size
+
+        self.order = np.arange(len(self.radii))
+        self.node_min = []
+        self.node_max = []
+        self.children = []
+        self.ranges = []
+        self.axes = []
+
+        if len(self.radii):
+            self.build(0, len(self.radii))
+
+        self.node_min = np.array(self.node_min).reshape(-1, 3)
+        self.node_max = np.array(self.node_max).reshape(-1, 3)
+        self.children = np.array(self.children, dtype=np.intp).reshape(-1, 2)
+        self.ranges = np.array(self.ranges, dtype=np.intp).reshape(-1, 2)
+
+    def build(self, start, end):
+        idx = self.order[start:end]
+        lo = np.min(self.centers[idx] - self.radii[idx, None], axis=0)
+        hi = np.max(self.centers[idx] + self.radii[idx, None], axis=0)
+        pad = 1e-9 * (np.max(hi - lo) + 1.0)
+
+        node = len(self.node_min)
+        self.node_min.append(lo - pad)
+        self.node_max.append(hi + pad)
+        self.children.append([-1, -1])
+        self.ranges.append([start, end])
+        self.axes.append(0)
+
+        if end - start <= self.leaf_size:
+            return node
+
+        # разбиение по медиане вдоль самой длинной оси центров
+        centroids = self.centers[idx]
+        axis = int(np.argmax(np.ptp(centroids, axis=0)))
+        mid = (end - start) // 2
+        part = np.argpartition(centroids[:, axis], mid)
+        self.order[start:end] = idx[part]
+        self.axes[node] = axis
+
+        left = self.build(start, start + mid)
+        right = self.build(start + mid, end)
+        self.children[node] = [left, right]
+        return node
+
+    def slab_test(self, node, origins, inv_dir, margin=0.0):
+        with np.errstate(invalid='ignore'):
+            t1 = (self.node_min[node] - margin - origins) * inv_dir
+            t2 = (self.node_max[node] + margin - origins) * inv_dir
+        lo = np.fmin(t1, t2)
+        hi = np.fmax(t1, t2)
+        tnear = np.fmax(np.fmax(lo[..., 0], lo[..., 1]), lo[..., 2])
+        tfar = np.fmin(np.fmin(hi[..., 0], hi[..., 1]), hi[..., 2])
+        return tnear, tfar
+
+    def closest_hit(self, origins, dirs, candidates=None):
+        # candidates — возрастающий список сфер, которые могут пересечь лучи (например, проецирующихся на плитку)
+        n = len(dirs)
+        hit_idx = np.full(n, -1, dtype=np.intp)
+        best_t = np.full(n, np.inf)
+
+        if candidates is not None and len(candidates) == 0:
+            count('rays_culled', n)
+            return hit_idx, best_t
+
+        if n == 0 or len(self.radii) == 0:
+            return hit_idx, best_t
+
+        origins = np.asarray(origins, dtype=np.float64)
+        allowed = None
+        if candidates is not None:
+            if len(candidates) <= self.leaf_size:
+                # кандидатов не больше, чем в листе: перебор без обхода дерева
+                t = ray_sphere_intersect_np(origins, dirs, self.centers[candidates], self.radii[candidates])
+                count('sphere_tests', t.size)
+                k = np.argmin(t, axis=1)
+                tk = t[np.arange(n), k]
+                hit = np.isfinite(tk)
+                hit_idx[hit] = candidates[k[hit]]
+                best_t[hit] = tk[hit]
+                return hit_idx, best_t
+            allowed = np.zeros(len(self.radii), dtype=bool)
+            allowed[candidates] = True
+
+        shared_origin = origins.ndim == 1
+        with np.errstate(divide='ignore'):
+            inv_dir = 1.0 / dirs
+
+        stack = [(0, np.arange(n))]
+        while stack:
+            node, rays = stack.pop()
+            o = origins if shared_origin else origins[rays]
+            tnear, tfar = self.slab_test(node, o, inv_dir[rays])
+            keep = (tnear <= tfar) & (tfar > 0) & (tnear <= best_t[rays])
+            if node == 0:
+                count('rays_culled', len(rays) - np.count_nonzero(keep))
+            rays = rays[keep]
+
+            if len(rays) == 0:
+                continue
+
+            left, right = self.children[node]
+            if left < 0:
+                start, end = self.ranges[node]
+                idx = self.order[start:end]
+                if allowed is not None:
+                    idx = idx[allowed[idx]]
+                    if len(idx) == 0:
+                        continue
+                o = origins if shared_origin else origins[rays]
+                t = ray_sphere_intersect_np(o, dirs[rays], self.centers[idx], self.radii[idx])
+                count('sphere_tests', t.size)
+                k = np.argmin(t, axis=1)
+                tk = t[np.arange(len(rays)), k]
+                candidate = idx[k]
+                better = (tk < best_t[rays]) | ((tk == best_t[rays]) & np.isfinite(tk) & (candidate < hit_idx[rays]))
+                best_t[rays[better]] = tk[better]
+                hit_idx[rays[better]] = candidate[better]
+                continue
+
+            # сначала обходим ближний по направлению пакета потомок
+            if np.mean(dirs[rays, self.axes[node]]) >= 0:
+                stack.append((right, rays))
+                stack.append((left, rays))
+            else:
+                stack.append((left, rays))
+                stack.append((right, rays))
+
+        return hit_idx, best_t
+
+    def occluded(self, origins, dirs, max_t, skip_idx):
+        n = len(dirs)
+        occluded = np.zeros(n, dtype=bool)
+
+        if n == 0 or len(self.radii) == 0:
+            return occluded
+
+        origins = np.asarray(origins, dtype=np.float64)
+        shared_origin = origins.ndim == 1
+        with np.errstate(divide='ignore'):
+            inv_dir = 1.0 / dirs
+
+        stack = [(0, np.arange(n))]
+        while stack:
+            node, rays = stack.pop()
+            rays = rays[~occluded[rays]]
+
+            if len(rays) == 0:
+                continue
+
+            o = origins if shared_origin else origins[rays]
+            tnear, tfar = self.slab_test(node, o, inv_dir[rays])
+            keep = (tnear <= tfar) & (tfar > 0) & (tnear < max_t[rays])
+            rays = rays[keep]
+
+            if len(rays) == 0:
+                continue
+
+            left, right = self.children[node]
+            if left < 0:
+                start, end = self.ranges[node]
+                idx = self.order[start:end]
+                o = origins if shared_origin else origins[rays]
+                t = ray_sphere_intersect_np(o, dirs[rays], self.centers[idx], self.radii[idx])
+                count('sphere_tests', t.size)
+                t[idx[None, :] == skip_idx[rays, None]] = np.inf
+                hit = np.any((t > 0) & (t < max_t[rays, None]), axis=1)
+                occluded[rays[hit]] = True
+                continue
+
+            stack.append((right, rays))
+            stack.append((left, rays))
+
+        return occluded
+
+    def soft_visibility(self, origins, dirs, max_t, skip_idx, light_radius):
+        # видимая доля сферического источника: один обход дерева по лучу к его центру,
+        # каждая сфера в конусе источника закрывает долю его углового диска
+        n = len(dirs)
+        visibility = np.ones(n)
+
+        if n == 0 or len(self.radii) == 0:
+            return visibility
+
+        origins = np.asarray(origins, dtype=np.float64)
+        alpha = np.arcsin(np.minimum(light_radius / np.maximum(max_t, 1e-12), 1.0))
+        with np.errstate(divide='ignore'):
+            inv_dir = 1.0 / dirs
+
+        stack = [(0, np.arange(n))]
+        while stack:
+            node, rays = stack.pop()
+            rays = rays[visibility[rays] > 0]
+
+            if len(rays) == 0:
+                continue
+
+            # конус до источника нигде не шире его радиуса, поэтому узлы расширяются на радиус
+            tnear, tfar = self.slab_test(node, origins[rays], inv_dir[rays], light_radius)
+            keep = (tnear <= tfar) & (tfar > 0) & (tnear < max_t[rays])
+            rays = rays[keep]
+
+            if len(rays) == 0:
+                continue
+
+            left, right = self.children[node]
+            if left < 0:
+                start, end = self.ranges[node]
+                idx = self.order[start:end]
+                oc = self.centers[idx] - origins[rays][:, None, :]
+                dist = np.maximum(norm_np(oc), 1e-12)
+                t = dot_np(oc, dirs[rays][:, None, :])
+                beta = np.arcsin(np.minimum(self.radii[idx] / dist, 1.0))
+                gamma = np.arccos(np.clip(t / dist, -1.0, 1.0))
+                occlusion = cone_overlap_np(alpha[rays, None], beta, gamma)
+                count('sphere_tests', occlusion.size)
+                # закрывают только сферы между точкой и источником
+                occlusion[(t <= 0) | (dist >= max_t[rays, None]) | (idx[None, :] == skip_idx[rays, None])] = 0
+                visibility[rays] *= np.prod(1 - occlusion, axis=1)
+                continue
+
+            stack.append((right, rays))
+            stack.append((left, rays))
+
+        return visibility
@@ -1,15 +1,33 @@
+import os
 import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import ttk
 from PIL import Image, ImageTk
+from profiler import RenderProfile, stage
+
+# пауза после последнего изменения размера, после которой строится качественное изображение
+SETTLE_DELAY_MS = 150
+POLL_DELAY_MS = 20
+CACHED_SIZES = 4
 
 class ImageDisplayComponent:
-    def __init__(self, parent_frame, resize_callback):
+    def __init__(self, parent_frame, resize_callback, timing_callback=None):
         self.labels = self.create_labels(parent_frame)
         self.images = {}
         self.view_images = {}
         self.prev_width = 0
         self.prev_height = 0
         self.resize_callback = resize_callback
+        self.timing_callback = timing_callback
+        self.profile = None
+        # время последнего качественного масштабирования хранится отдельно: профиль рендера из потока не меняется
+        self.resize_profile = None
+        # качественное масштабирование выполняется в отдельном потоке, PhotoImage создается только в потоке Tk
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.generation = 0
+        self.resized = OrderedDict()
+        self.settle_job = None
 
     def create_labels(self, parent_frame):
         ttk.Label(parent_frame, text="Вид спереди:").grid(row=0, column=0, sticky='ew')
@@ -35,14 +53,18 @@ class ImageDisplayComponent:
             'side2': label_side2
         }
 
-    def update_images(self, images, view_images):
+    def update_images(self, images, view_images, profile=None):
         self.images = images
         self.view_images = view_images
+        self.profile = profile
+        self.resize_profile = None
+        self.generation += 1
+        self.resized.clear()
         self.prev_width = 0
         self.prev_height = 0
-        self.resize_images()
+        self.resize_images(settle_delay=0)
 
-    def resize_images(self):
+    def resize_images(self, settle_delay=SETTLE_DELAY_MS):
         if not self.view_images:
             return
 
@@ -59,13 +81,74 @@ class ImageDisplayComponent:
 
         side_length = min(front_width, front_height)
 
-        for view_name, pil_image in self.view_images.items():
-            resized = pil_image.resize((side_length, side_length), Image.LANCZOS)
+        # готовый качественный вариант для этого размера показывается сразу
+        if side_length in self.resized:
+            self.resized.move_to_end(side_length)
+            self.show_images(self.resized[side_length])
+            return
+
+        # пока размер меняется — быстрый фильтр, качественный после паузы
+        self.show_images({view_name: pil_image.resize((side_length, side_length), Image.NEAREST)
+                          for view_name, pil_image in self.view_images.items()})
+        if self.settle_job is not None:
+            self.labels['front'].after_cancel(self.settle_job)
+        self.settle_job = self.labels['front'].after(settle_delay, self.start_resize, side_length)
+
+    def start_resize(self, side_length):
+        self.settle_job = None
+        profile = RenderProfile()
+        future = self.executor.submit(self.resize_views, dict(self.view_images), side_length, profile)
+        self.labels['front'].after(POLL_DELAY_MS, self.finish_resize, future, self.generation, side_length, profile)
+
+    def resize_views(self, view_images, side_length, profile):
+        resized = {}
+        for view_name, pil_image in view_images.items():
+            with stage('resize', profile):
+                resized[view_name] = pil_image.resize((side_length, side_length), Image.LANCZOS)
+        return resized
+
+    def finish_resize(self, future, generation, side_length, profile):
+        if not future.done():
+            self.labels['front'].after(POLL_DELAY_MS, self.finish_resize, future, generation, side_length, profile)
+            return
+        # результат для устаревших изображений отбрасывается
+        if generation != self.generation:
+            return
+
+        self.resized[side_length] = future.result()
+        while len(self.resized) > CACHED_SIZES:
+            self.resized.popitem(last=False)
+        if side_length == min(self.prev_width, self.prev_height):
+            self.show_images(self.resized[side_length])
+        if self.profile is not None:
+            self.resize_profile = profile
+            if self.timing_callback is not None:
+                self.timing_callback()
+
+    def timing_profile(self):
+        # копия профиля рендера с последним качественным масштабированием — для сводки и трассировки
+        if self.profile is None:
+            return None
+        combined = RenderProfile()
+        combined.wall_time = self.profile.wall_time
+        combined.merge(self.profile.to_dict())
+        if self.resize_profile is not None:
+            combined.merge(self.resize_profile.to_dict())
+        return combined
+
+    def show_images(self, resized_images):
+        for view_name, resized in resized_images.items():
             photo = ImageTk.PhotoImage(resized)
             self.labels[view_name].config(image=photo)
             self.labels[view_name].image = photo
 
-    def save_images(self):
+    def save_images(self, directory='.'):
+        # номер подбирается так, чтобы не перезаписать ранее сохраненные изображения
+        number = 1
+        while any(os.path.exists(os.path.join(directory, f"{view_name}_{number:03d}.png")) for view_name in self.images):
+            number += 1
         for view_name, img in self.images.items():
-            img.save(f"{view_name}.png")
+            img.save(os.path.join(directory, f"{view_name}_{number:03d}.png"))
 
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
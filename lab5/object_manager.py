@@ -2,6 +2,7 @@ import numpy as np
 import tkinter as tk
 from tkinter import ttk
 from tkinter.colorchooser import askcolor
+from scene import Scene
 
 class ObjectManagerComponent:
     def __init__(self, parent_frame, regrid_callback):
@@ -58,6 +59,12 @@ class ObjectManagerComponent:
         sphere_params['shin'].insert(0, "32")
         row += 1
 
+        ttk.Label(frame, text="Отражение (0-1):").grid(row=row, column=0)
+        sphere_params['refl'] = ttk.Entry(frame, width=5)
+        sphere_params['refl'].grid(row=row, column=1)
+        sphere_params['refl'].insert(0, "0")
+        row += 1
+
         ttk.Button(frame, text="Удалить", command=lambda: self.delete_sphere(sphere_params)).grid(row=row, column=0, columnspan=2)
         ttk.Button(frame, text="Выбрать", command=lambda: self.pick_color(sphere_params)).grid(row=row, column=2, columnspan=2)
 
@@ -110,6 +117,12 @@ class ObjectManagerComponent:
         light_params['i0'].insert(0, "10000")
         row += 1
 
+        ttk.Label(frame, text="Радиус (мм):").grid(row=row, column=0)
+        light_params['radius'] = ttk.Entry(frame, width=10)
+        light_params['radius'].grid(row=row, column=1)
+        light_params['radius'].insert(0, "0")
+        row += 1
+
         ttk.Button(frame, text="Удалить", command=lambda: self.delete_light(light_params)).grid(row=row, column=0, columnspan=2)
         ttk.Button(frame, text="Выбрать", command=lambda: self.pick_color(light_params)).grid(row=row, column=2, columnspan=2)
 
@@ -146,7 +159,8 @@ class ObjectManagerComponent:
                 'color': np.array([float(sphere['cr'].get()), float(sphere['cg'].get()), float(sphere['cb'].get())]),
                 'kd': float(sphere['kd'].get()),
                 'ks': float(sphere['ks'].get()),
-                'shin': float(sphere['shin'].get())
+                'shin': float(sphere['shin'].get()),
+                'refl': float(sphere['refl'].get())
             }
             spheres_list.append(s)
         return spheres_list
@@ -157,7 +171,11 @@ class ObjectManagerComponent:
             l = {
                 'pos': np.array([float(light['x'].get()), float(light['y'].get()), float(light['z'].get())]),
                 'color': np.array([float(light['cr'].get()), float(light['cg'].get()), float(light['cb'].get())]),
-                'i0': float(light['i0'].get())
+                'i0': float(light['i0'].get()),
+                'radius': float(light['radius'].get())
             }
             lights_list.append(l)
         return lights_list
+
+    def get_scene(self):
+        return Scene.from_dicts(self.get_spheres(), self.get_lights())
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+STAGE_LABELS = {
+    'cache': 'кэш',
+    'scene': 'сцена',
+    'tiles': 'плитки',
+    'ray_generation': 'лучи',
+    'intersection': 'пересеч.',
+    'shadow': 'тени',
+    'shading': 'освещ.',
+    'reflection': 'отраж.',
+    'normalize': 'норм.',
+    'pil': 'PIL',
+    'png': 'PNG',
+    'resize': 'масштаб',
+}
+
+
+class RenderProfile:
+    def __init__(self):
+        self.wall_time = 0.0
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+
+    def add_stage(self, name, start, duration, pid=None):
+        self.stages[name] = self.stages.get(name, 0.0) + duration
+        self.events.append((name, start, duration, pid or os.getpid()))
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def to_dict(self):
+        return {'wall_time': self.wall_time, 'stages': self.stages, 'counters': self.counters, 'events': self.events}
+
+    def merge(self, data):
+        for name, duration in data['stages'].items():
+            self.stages[name] = self.stages.get(name, 0.0) + duration
+        for name, value in data['counters'].items():
+            self.count(name, value)
+        self.events.extend(data['events'])
+
+    def summary(self):
+        rays = self.counters.get('rays', 0)
+        shadow_rays = self.counters.get('shadow_rays', 0)
+        tests = self.counters.get('sphere_tests', 0)
+        parts = [f"Рендер {self.wall_time:.3f} с",
+                 f"лучи {rays}, теневые {shadow_rays}, отсеч. {self.counters.get('rays_culled', 0)}"]
+        if rays + shadow_rays:
+            parts.append(f"сфер/луч {tests / (rays + shadow_rays):.2f}")
+        if 'cache_hits' in self.counters or 'cache_misses' in self.counters:
+            parts.append(f"кэш: попаданий {self.counters.get('cache_hits', 0)}, "
+                         f"промахов {self.counters.get('cache_misses', 0)}")
+        if 'reflection_rays' in self.counters:
+            parts.append(f"отраж. лучи {self.counters['reflection_rays']}")
+        if 'aa_pixels' in self.counters:
+            parts.append(f"сглаж. пикс. {self.counters['aa_pixels']}")
+        parts.append(", ".join(f"{label} {self.stages[name]:.3f}"
+                               for name, label in STAGE_LABELS.items() if name in self.stages))
+        return " | ".join(parts)
+
+    def dump(self, path):
+        # формат Trace Event (chrome://tracing, Perfetto) плюс агрегированные значения
+        origin = min((start for _, start, _, _ in self.events), default=0.0)
+        trace = {
+            'traceEvents': [{'name': name, 'ph': 'X', 'pid': 0, 'tid': pid,
+                             'ts': (start - origin) * 1e6, 'dur': duration * 1e6}
+                            for name, start, duration, pid in self.events],
+            'wall_time': self.wall_time,
+            'stages': self.stages,
+            'counters': self.counters,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False, indent=1)
+
+
+_active = [None]
+
+
+def activate(profile):
+    previous = _active[0]
+    _active[0] = profile
+    return previous
+
+
+@contextmanager
+def stage(name, profile=None):
+    profile = profile or _active[0]
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_stage(name, start, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    if _active[0] is not None:
+        _active[0].count(name, value)
@@ -0,0 +1,315 @@
+import numpy as np
+from profiler import stage, count
+
+SHADOW_EPSILON = 0.001
+# отражения: максимальное число отскоков и вклад, ниже которого луч дальше не трассируется
+REFLECTION_DEPTH = 3
+REFLECTION_THRESHOLD = 0.01
+
+
+def dot_np(a, b):
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1] + a[..., 2] * b[..., 2]
+
+
+def norm_np(v):
+    return np.sqrt(dot_np(v, v))
+
+
+def compute_ray_directions_np(ii, jj, w_res, h_res, pixel_w, pixel_h, sc, sx, sy, eye):
+    px = (jj - w_res / 2 + 0.5) * pixel_w
+    py = -(ii - h_res / 2 + 0.5) * pixel_h
+    pixel_pos = sc + px[:, None] * sx + py[:, None] * sy
+    ray_dir = pixel_pos - eye
+    ray_norm = norm_np(ray_dir)
+    valid = ray_norm > 0
+    np.divide(ray_dir, ray_norm[:, None], out=ray_dir, where=valid[:, None])
+    return ray_dir, valid
+
+
+def ray_sphere_intersect_np(origins, dirs, centers, radii):
+    # origins: (3,) или (N, 3), dirs: (N, 3), centers: (M, 3) -> t: (N, M)
+    oc = np.asarray(origins)[..., None, :] - centers
+    a = dot_np(dirs, dirs)[:, None]
+    b = 2 * dot_np(oc, dirs[:, None, :])
+    c = dot_np(oc, oc) - radii ** 2
+    disc = b ** 2 - 4 * a * c
+
+    sqrt_disc = np.sqrt(np.maximum(disc, 0))
+    t1 = (-b - sqrt_disc) / (2 * a)
+    t2 = (-b + sqrt_disc) / (2 * a)
+
+    t = np.where(t1 > 0, t1, np.where(t2 > 0, t2, np.inf))
+    return np.where(disc < 0, np.inf, t)
+
+
+def compute_point_light_visibility_np(hit_points, normals, light_pos, bvh, hit_idx):
+    light_dir = light_pos - hit_points
+    dist = norm_np(light_dir)
+    valid = dist > 0
+    np.divide(light_dir, dist[:, None], out=light_dir, where=valid[:, None])
+
+    shadow_origin = hit_points + normals * SHADOW_EPSILON
+    shadowed = bvh.occluded(shadow_origin, light_dir, dist, hit_idx)
+
+    visibility = (valid & ~shadowed).astype(np.float64)
+    return visibility, light_dir, dist
+
+
+def cone_overlap_np(alpha, beta, gamma):
+    # доля углового диска источника (радиус alpha), закрытая диском сферы (радиус beta) на угловом
+    # расстоянии gamma; пересечение конусов приближается площадью линзы двух кругов на плоскости
+    alpha, beta, gamma = np.broadcast_arrays(alpha, beta, gamma)
+    lens = np.zeros(alpha.shape)
+
+    inside = gamma <= np.abs(alpha - beta)
+    lens[inside] = np.pi * np.minimum(alpha, beta)[inside] ** 2
+
+    partial = ~inside & (gamma < alpha + beta)
+    a, b, g = alpha[partial], beta[partial], gamma[partial]
+    lens[partial] = (a * a * np.arccos(np.clip((g * g + a * a - b * b) / (2 * g * a), -1.0, 1.0))
+                     + b * b * np.arccos(np.clip((g * g + b * b - a * a) / (2 * g * b), -1.0, 1.0))
+                     - 0.5 * np.sqrt(np.maximum((-g + a + b) * (g + a - b) * (g - a + b) * (g + a + b), 0)))
+    return np.minimum(lens / (np.pi * alpha * alpha), 1.0)
+
+
+def compute_area_light_visibility_np(hit_points, normals, light_pos, light_radius, bvh, hit_idx):
+    light_dir = light_pos - hit_points
+    dist = norm_np(light_dir)
+    valid = dist > 0
+    np.divide(light_dir, dist[:, None], out=light_dir, where=valid[:, None])
+
+    shadow_origin = hit_points + normals * SHADOW_EPSILON
+    visibility = bvh.soft_visibility(shadow_origin, light_dir, dist, hit_idx, float(light_radius))
+    return visibility * valid, light_dir, dist
+
+
+def compute_sampled_light_visibility_np(hit_points, normals, light_pos, light_radius, bvh, hit_idx, samples):
+    # эталон для проверки аналитической полутени: samples x samples стратифицированных лучей
+    # к диску источника, обращенному к точке
+    light_dir = light_pos - hit_points
+    dist = norm_np(light_dir)
+    valid = dist > 0
+    np.divide(light_dir, dist[:, None], out=light_dir, where=valid[:, None])
+
+    helper = np.where(np.abs(light_dir[:, :1]) < 0.9, [[1.0, 0.0, 0.0]], [[0.0, 1.0, 0.0]])
+    u = np.cross(light_dir, helper)
+    u /= np.maximum(norm_np(u), 1e-12)[:, None]
+    v = np.cross(light_dir, u)
+
+    # одна ячейка сетки — одна выборка со смещением внутри ячейки; радиус через корень для равномерности по площади
+    rng = np.random.default_rng(0)
+    cells = np.stack(np.meshgrid(np.arange(samples), np.arange(samples)), axis=-1).reshape(-1, 2)
+    strata = (cells + rng.random(cells.shape)) / samples
+    radius = light_radius * np.sqrt(strata[:, 0])
+    angle = 2 * np.pi * strata[:, 1]
+
+    shadow_origin = hit_points + normals * SHADOW_EPSILON
+    visible = np.zeros(len(hit_points))
+    for offset_u, offset_v in zip(radius * np.cos(angle), radius * np.sin(angle)):
+        sample_dir = light_pos + u * offset_u + v * offset_v - shadow_origin
+        sample_dist = norm_np(sample_dir)
+        sample_dir /= np.maximum(sample_dist, 1e-12)[:, None]
+        visible += ~bvh.occluded(shadow_origin, sample_dir, sample_dist, hit_idx)
+    count('shadow_rays', len(hit_points) * (len(strata) - 1))
+    return visible / len(strata) * valid, light_dir, dist
+
+
+def compute_light_visibility_np(hit_points, normals, light_pos, light_radius, bvh, hit_idx, light_samples=0):
+    if light_radius <= 0:
+        return compute_point_light_visibility_np(hit_points, normals, light_pos, bvh, hit_idx)
+    if light_samples:
+        return compute_sampled_light_visibility_np(hit_points, normals, light_pos, light_radius, bvh, hit_idx,
+                                                   light_samples)
+    return compute_area_light_visibility_np(hit_points, normals, light_pos, light_radius, bvh, hit_idx)
+
+
+def compute_lighting_np(hit_points, normals, view_dirs, hit_idx, scene, shadow_mask=None, light_samples=0):
+    color = np.zeros((len(hit_idx), 3))
+    sphere_color = scene.colors[hit_idx]
+    kd = scene.kd[hit_idx]
+    ks = scene.ks[hit_idx]
+    shin = scene.shin[hit_idx]
+
+    lights = zip(scene.light_pos, scene.light_color, scene.light_i0, scene.light_radius)
+    for k, (pos, light_color, i0, radius) in enumerate(lights):
+        with stage('shadow'):
+            visibility, light_dir, dist = compute_light_visibility_np(
+                hit_points, normals, pos, radius, scene.bvh, hit_idx, light_samples)
+        count('shadow_rays', len(hit_idx))
+        if shadow_mask is not None:
+            # бит k отмечает видимость k-го источника (по модулю 32) для поиска границ теней
+            shadow_mask |= (visibility > 0).astype(np.uint32) << np.uint32(k % 32)
+
+        with stage('shading'):
+            diffuse = kd * np.maximum(0, dot_np(normals, light_dir))
+            h = light_dir + view_dirs
+            h_norm = norm_np(h)
+            nonzero = h_norm > 0
+            np.divide(h, h_norm[:, None], out=h, where=nonzero[:, None])
+
+            specular = ks * np.maximum(0, dot_np(normals, h)) ** shin
+            atten = i0 / (dist ** 2 + 1)
+            light_contrib = light_color * atten[:, None] * visibility[:, None]
+            color += sphere_color * light_contrib * diffuse[:, None] + light_contrib * specular[:, None]
+
+    return color
+
+
+def compute_reflections_np(hit_points, normals, view_dirs, hit_idx, scene, max_depth, min_weight, light_samples=0):
+    # волновой фронт: на каждом отскоке живые лучи собираются в плотные массивы и пересекаются
+    # со сценой одним вызовом; лучи с вкладом не больше min_weight отбрасываются
+    color = np.zeros((len(hit_idx), 3))
+    pixels = np.arange(len(hit_idx))
+    weight = scene.refl[hit_idx].astype(np.float64)
+
+    for _ in range(max_depth):
+        alive = weight > min_weight
+        pixels, hit_points, normals, view_dirs, weight = (
+            pixels[alive], hit_points[alive], normals[alive], view_dirs[alive], weight[alive])
+        if len(pixels) == 0:
+            break
+        count('reflection_rays', len(pixels))
+
+        ray_dir = 2 * dot_np(normals, view_dirs)[:, None] * normals - view_dirs
+        origins = hit_points + normals * SHADOW_EPSILON
+        with stage('reflection'):
+            ray_hit, t = scene.bvh.closest_hit(origins, ray_dir)
+
+        hit = ray_hit >= 0
+        pixels, origins, ray_dir, weight, ray_hit = pixels[hit], origins[hit], ray_dir[hit], weight[hit], ray_hit[hit]
+        hit_points = origins + t[hit][:, None] * ray_dir
+        normals = (hit_points - scene.centers[ray_hit]) / scene.radii[ray_hit][:, None]
+        view_dirs = -ray_dir
+
+        color[pixels] += weight[:, None] * compute_lighting_np(hit_points, normals, view_dirs, ray_hit, scene,
+                                                               light_samples=light_samples)
+        weight = weight * scene.refl[ray_hit]
+
+    return color
+
+
+def project_sphere_bounds_np(view, w_mm, h_mm, w_res, h_res, centers, radii):
+    # прямоугольник пикселей [i0, i1) x [j0, j1), лучи которых могут попасть в сферу
+    eye = np.asarray(view['eye'], dtype=np.float64)
+    sx = np.asarray(view['sx'], dtype=np.float64)
+    sy = np.asarray(view['sy'], dtype=np.float64)
+    forward = np.asarray(view['sc'], dtype=np.float64) - eye
+    screen_dist = norm_np(forward)
+    forward = forward / screen_dist
+
+    rel = np.asarray(centers, dtype=np.float64).reshape(-1, 3) - eye
+    z = rel @ forward
+    x = rel @ sx
+    y = rel @ sy
+    r = np.asarray(radii, dtype=np.float64)
+
+    # касательные к сфере плоскости, проходящие через глаз, дают точные границы проекции
+    in_front = z > r
+    denom = np.where(in_front, z * z - r * r, 1.0)
+    spread_x = r * np.sqrt(np.maximum(x * x + z * z - r * r, 0))
+    spread_y = r * np.sqrt(np.maximum(y * y + z * z - r * r, 0))
+    px_min = screen_dist * (x * z - spread_x) / denom
+    px_max = screen_dist * (x * z + spread_x) / denom
+    py_min = screen_dist * (y * z - spread_y) / denom
+    py_max = screen_dist * (y * z + spread_y) / denom
+
+    pixel_w = w_mm / w_res
+    pixel_h = h_mm / h_res
+    j0 = np.floor(px_min / pixel_w + w_res / 2 - 0.5) - 1
+    j1 = np.ceil(px_max / pixel_w + w_res / 2 - 0.5) + 2
+    i0 = np.floor(-py_max / pixel_h + h_res / 2 - 0.5) - 1
+    i1 = np.ceil(-py_min / pixel_h + h_res / 2 - 0.5) + 2
+
+    # сфера пересекает плоскость глаза: консервативно весь экран; сфера целиком позади: ничего
+    crossing = ~in_front & (z > -r)
+    behind = z <= -r
+    i0 = np.where(crossing, 0, np.where(behind, 0, i0))
+    i1 = np.where(crossing, h_res, np.where(behind, 0, i1))
+    j0 = np.where(crossing, 0, np.where(behind, 0, j0))
+    j1 = np.where(crossing, w_res, np.where(behind, 0, j1))
+
+    bounds = np.stack([i0, i1, j0, j1], axis=-1)
+    bounds[:, :2] = np.clip(bounds[:, :2], 0, h_res)
+    bounds[:, 2:] = np.clip(bounds[:, 2:], 0, w_res)
+    return bounds.astype(np.intp)
+
+
+def project_views_np(views, screen, centers, radii):
+    # проекции всех сфер на каждый вид считаются один раз на рендер
+    w_mm, h_mm, w_res, h_res = screen
+    return {view_name: project_sphere_bounds_np(view, w_mm, h_mm, w_res, h_res, centers, radii)
+            for view_name, view in views.items()}
+
+
+def tile_candidates_np(bounds, i0, i1, j0, j1):
+    # сферы, проекция которых пересекает прямоугольник пикселей [i0, i1) x [j0, j1)
+    return np.flatnonzero((bounds[:, 0] < i1) & (bounds[:, 1] > i0) & (bounds[:, 2] < j1) & (bounds[:, 3] > j0))
+
+
+def trace_pixels_np(ii, jj, w_mm, h_mm, w_res, h_res, view, scene, candidates=None):
+    eye = view['eye']
+    pixel_w = w_mm / w_res
+    pixel_h = h_mm / h_res
+    n = len(ii)
+
+    hit_idx = np.full(n, -1, dtype=np.intp)
+    hit_point = np.zeros((n, 3))
+    normal = np.zeros((n, 3))
+    with stage('ray_generation'):
+        ray_dir, valid = compute_ray_directions_np(ii, jj, w_res, h_res, pixel_w, pixel_h,
+                                                   view['sc'], view['sx'], view['sy'], eye)
+    rays = np.flatnonzero(valid)
+    count('rays', len(rays))
+
+    with stage('intersection'):
+        ray_hit, min_t = scene.bvh.closest_hit(eye, ray_dir[rays], candidates)
+
+    hit = ray_hit >= 0
+    rays = rays[hit]
+    hit_idx[rays] = ray_hit[hit]
+    hit_point[rays] = eye + min_t[hit][:, None] * ray_dir[rays]
+    normal[rays] = (hit_point[rays] - scene.centers[ray_hit[hit]]) / scene.radii[ray_hit[hit]][:, None]
+    return hit_idx, hit_point, normal, -ray_dir
+
+
+def shade_pixels_np(hit_idx, hit_point, normal, view_dir, scene, shadow_mask=None, max_depth=0,
+                    min_weight=REFLECTION_THRESHOLD, light_samples=0):
+    color = np.zeros((len(hit_idx), 3))
+    rays = np.flatnonzero(hit_idx >= 0)
+    if shadow_mask is not None:
+        shadow_mask[:] = 0
+
+    if len(rays) == 0:
+        return color
+
+    mask = None if shadow_mask is None else np.zeros(len(rays), dtype=np.uint32)
+    color[rays] = compute_lighting_np(hit_point[rays], normal[rays], view_dir[rays], hit_idx[rays], scene, mask,
+                                      light_samples)
+    if max_depth > 0:
+        color[rays] += compute_reflections_np(hit_point[rays], normal[rays], view_dir[rays], hit_idx[rays], scene,
+                                              max_depth, min_weight, light_samples)
+    if shadow_mask is not None:
+        shadow_mask[rays] = mask
+    return color
+
+
+def find_edge_pixels_np(hit_idx, shadow_mask):
+    # пиксель на границе, если сфера или набор видимых источников отличаются от соседа справа или снизу
+    edges = np.zeros(hit_idx.shape, dtype=bool)
+    for axis in (-1, -2):
+        size = hit_idx.shape[axis]
+        head = [slice(None)] * hit_idx.ndim
+        tail = [slice(None)] * hit_idx.ndim
+        head[axis] = slice(0, size - 1)
+        tail[axis] = slice(1, size)
+        head, tail = tuple(head), tuple(tail)
+        diff = (hit_idx[head] != hit_idx[tail]) | (shadow_mask[head] != shadow_mask[tail])
+        edges[head] |= diff
+        edges[tail] |= diff
+    return edges
+
+
+def render_pixels_np(ii, jj, w_mm, h_mm, w_res, h_res, view, scene, candidates=None, max_depth=0,
+                     min_weight=REFLECTION_THRESHOLD, light_samples=0):
+    return shade_pixels_np(*trace_pixels_np(ii, jj, w_mm, h_mm, w_res, h_res, view, scene, candidates), scene,
+                           max_depth=max_depth, min_weight=min_weight, light_samples=light_samples)
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import numpy as np
+from scene import SPHERE_ARRAYS, LIGHT_ARRAYS
+
+# меняется при изменении формата записей или модели освещения, чтобы старые записи не использовались
+CACHE_VERSION = b'lab5-render-cache-1'
+DEFAULT_CACHE_SIZE = 512 * 2 ** 20
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'lab5')
+
+
+class RenderCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def compute_key(self, scene, screen, views, options):
+        digest = hashlib.sha256(CACHE_VERSION)
+        for name in SPHERE_ARRAYS + LIGHT_ARRAYS:
+            array = np.ascontiguousarray(getattr(scene, name), dtype=np.float32)
+            digest.update(name.encode())
+            digest.update(repr(array.shape).encode())
+            digest.update(array.tobytes())
+        digest.update(repr(tuple(float(value) for value in screen)).encode())
+        for view_name, view in views.items():
+            digest.update(view_name.encode())
+            for key in ('eye', 'sx', 'sy', 'sc'):
+                digest.update(np.asarray(view[key], dtype=np.float64).tobytes())
+        digest.update(repr(sorted(options.items())).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                radiance = {view_name: data[view_name] for view_name in data.files}
+            # время изменения служит отметкой последнего использования для вытеснения
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return radiance
+
+    def store(self, key, radiance):
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        # ошибка записи (например, нет места) не должна прерывать рендер
+        try:
+            with open(temp_path, 'wb') as f:
+                np.savez(f, **radiance)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
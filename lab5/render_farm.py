@@ -0,0 +1,284 @@
+import argparse
+import itertools
+import os
+import pickle
+import sys
+import traceback
+from collections import deque
+from multiprocessing import AuthenticationError, Process
+from multiprocessing.connection import Client, Listener, wait
+from profiler import RenderProfile, activate
+from render_pool import (RenderPool, RenderCancelled, TILE_SIZE, GBUFFER_KEYS, render_tile, supersample_tile,
+                         render_rows_task, tile_pixels, trace_and_shade_pixels, supersample_colors,
+                         render_row_colors, write_rows)
+
+# узел распаковывает pickle от координатора, поэтому подключиться может только знающий общий ключ;
+# ключа по умолчанию нет, он задается файлом или переменной окружения
+AUTHKEY_ENV = 'LAB5_FARM_KEY'
+# задач одновременно в работе на узле: пока узел считает одну, следующая уже в пути
+TASKS_PER_WORKER = 2
+
+
+def parse_address(text):
+    # host:port — TCP, иначе путь к Unix-сокету
+    host, separator, port = text.rpartition(':')
+    if separator and port.isdigit():
+        return host or '127.0.0.1', int(port)
+    return text
+
+
+def load_authkey(path=None):
+    # ключ из файла или из переменной окружения; в командной строке он был бы виден в ps
+    if path is not None:
+        with open(path, 'rb') as f:
+            authkey = f.read().strip()
+    else:
+        authkey = os.environ.get(AUTHKEY_ENV, '').strip().encode()
+    if not authkey:
+        raise ValueError(f"не задан ключ фермы: укажите файл ключа или переменную {AUTHKEY_ENV}")
+    return authkey
+
+
+def execute(payload, kind, args, inputs):
+    if kind == 'tile':
+        view_name, tile, step, skip_step = args
+        ii, jj = tile_pixels(tile, step, skip_step)
+        return trace_and_shade_pixels(payload, view_name, ii, jj, inputs)
+    if kind == 'supersample':
+        view_name, ii, jj = args
+        return supersample_colors(payload, view_name, ii, jj)
+    if kind == 'rows':
+        view_name, rows = args
+        return render_row_colors(payload, view_name, rows)
+    raise ValueError(f"неизвестный тип задачи {kind!r}")
+
+
+def serve_connection(connection):
+    payloads = {}
+    while True:
+        message = connection.recv()
+
+        if message[0] == 'scene':
+            # сцена приходит один раз на рендер и хранится, пока не придет следующая
+            _, scene_id, data = message
+            payloads = {scene_id: pickle.loads(data)}
+        elif message[0] == 'task':
+            _, task_id, scene_id, kind, args, inputs = message
+            profile = RenderProfile()
+            previous = activate(profile)
+            try:
+                result = execute(payloads[scene_id], kind, args, inputs)
+            except Exception:
+                connection.send(('error', task_id, traceback.format_exc()))
+            else:
+                connection.send(('result', task_id, result, profile.to_dict()))
+            finally:
+                activate(previous)
+
+
+def serve(address, authkey):
+    if not authkey:
+        raise ValueError("узел фермы не запускается без ключа")
+    with Listener(address, authkey=authkey) as listener:
+        while True:
+            try:
+                connection = listener.accept()
+            except AuthenticationError:
+                # чужой ключ: соединение отклоняется, узел продолжает ждать координатора
+                continue
+            with connection:
+                # координатор отключился или прервал рендер — узел ждет следующего
+                try:
+                    serve_connection(connection)
+                except (EOFError, OSError):
+                    pass
+
+
+class FarmWorker:
+    def __init__(self, address, authkey):
+        self.address = address
+        try:
+            self.connection = Client(address, authkey=authkey)
+        except AuthenticationError:
+            raise ConnectionError(f"узел {address} отклонил ключ фермы") from None
+        self.scene_id = None
+        self.pending = {}
+
+    def close(self):
+        self.connection.close()
+
+
+class FarmPool(RenderPool):
+    def __init__(self, addresses, authkey, tile_size=TILE_SIZE):
+        if not authkey:
+            raise ValueError("для подключения к ферме нужен ключ")
+        super().__init__(0, tile_size)
+        self.addresses = [parse_address(address) if isinstance(address, str) else address for address in addresses]
+        self.processes = len(self.addresses)
+        self.authkey = authkey
+        self.workers = []
+        self.scene_id = 0
+        self.scene_data = None
+        self.task_ids = itertools.count()
+
+    def start(self):
+        if not self.workers:
+            self.workers = [FarmWorker(address, self.authkey) for address in self.addresses]
+
+    def publish(self, payload):
+        super().publish(payload)
+        self.scene_id += 1
+        self.scene_data = self.scene.array.tobytes()
+
+    def prepare(self, function, task):
+        # задача пула с дескрипторами разделяемой памяти превращается в данные, понятные удаленному узлу
+        if function is render_tile:
+            _, _, view_index, view_name, tile, retrace, step, skip_step = task
+            inputs = None
+            if not retrace:
+                ii, jj = tile_pixels(tile, step, skip_step)
+                inputs = {key: self.buffers[key].array[view_index, ii, jj] for key in GBUFFER_KEYS}
+            return 'tile', (view_name, tile, step, skip_step), inputs
+        if function is supersample_tile:
+            _, _, _, view_name, ii, jj = task
+            return 'supersample', (view_name, ii, jj), None
+        if function is render_rows_task:
+            _, _, view_name, _, rows = task
+            return 'rows', (view_name, rows), None
+        raise ValueError(f"задача {function.__name__} не поддерживается фермой")
+
+    def apply(self, function, task, result):
+        if function is render_tile:
+            _, _, view_index, _, tile, _, step, skip_step = task
+            ii, jj = tile_pixels(tile, step, skip_step)
+            for key, value in result.items():
+                self.buffers[key].array[view_index, ii, jj] = value
+        elif function is supersample_tile:
+            _, _, view_index, _, ii, jj = task
+            self.buffers['frame'].array[view_index, ii, jj] = result
+        else:
+            _, _, _, path, rows = task
+            write_rows(path, rows, result)
+
+    def send(self, worker, function, task):
+        if worker.scene_id != self.scene_id:
+            worker.connection.send(('scene', self.scene_id, self.scene_data))
+            worker.scene_id = self.scene_id
+        task_id = next(self.task_ids)
+        kind, args, inputs = self.prepare(function, task)
+        worker.connection.send(('task', task_id, self.scene_id, kind, args, inputs))
+        worker.pending[task_id] = task
+
+    def run_tasks(self, function, tasks, cancel=None):
+        self.start()
+        try:
+            yield from self.schedule(function, tasks, cancel)
+        except BaseException:
+            # после ошибки или отмены в соединениях могут остаться непрочитанные ответы
+            self.disconnect()
+            raise
+
+    def schedule(self, function, tasks, cancel):
+        workers = list(self.workers)
+        # сначала каждому узлу достается непрерывный блок задач: соседние плитки считаются на одном узле
+        block = -(-len(tasks) // len(workers))
+        queues = [deque(tasks[k * block:(k + 1) * block]) for k in range(len(workers))]
+        owners = {id(worker): queue for worker, queue in zip(workers, queues)}
+
+        while True:
+            cancelled = cancel is not None and cancel.is_set()
+            if not cancelled:
+                for worker in list(workers):
+                    while len(worker.pending) < TASKS_PER_WORKER:
+                        task = self.next_task(owners[id(worker)], queues)
+                        if task is None:
+                            break
+                        try:
+                            self.send(worker, function, task)
+                        except OSError:
+                            owners[id(worker)].append(task)
+                            self.drop(worker, workers, owners)
+                            break
+
+            busy = [worker for worker in workers if worker.pending]
+            if not busy:
+                if cancelled:
+                    raise RenderCancelled()
+                return
+
+            ready = wait([worker.connection for worker in busy])
+            for worker in busy:
+                if worker.connection not in ready:
+                    continue
+                try:
+                    message = worker.connection.recv()
+                except (EOFError, OSError):
+                    self.drop(worker, workers, owners)
+                    continue
+
+                task = worker.pending.pop(message[1])
+                if message[0] == 'error':
+                    raise RuntimeError(f"ошибка на узле {worker.address}:\n{message[2]}")
+                if not cancelled:
+                    self.apply(function, task, message[2])
+                    yield task, message[3]
+
+    def drop(self, worker, workers, owners):
+        # узел пропал: его задачи возвращаются в очередь и достанутся остальным
+        owners[id(worker)].extend(worker.pending.values())
+        worker.pending.clear()
+        worker.close()
+        workers.remove(worker)
+        self.workers.remove(worker)
+        if not workers:
+            raise ConnectionError("нет доступных узлов рендера")
+
+    def next_task(self, own, queues):
+        if own:
+            return own.popleft()
+        # своя очередь пуста — задача забирается с конца самой длинной чужой очереди
+        victim = max(queues, key=len)
+        return victim.pop() if victim else None
+
+    def disconnect(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+    def close(self):
+        self.disconnect()
+        super().close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Узел фермы рендера: принимает сцену и плитки от координатора")
+    parser.add_argument('--listen', required=True, help="host:port для TCP или путь к Unix-сокету")
+    parser.add_argument('-n', '--workers', type=int, default=1,
+                        help="число узлов: порты port, port+1, ... или сокеты path.0, path.1, ...")
+    parser.add_argument('--authkey-file', metavar='ФАЙЛ', default=None,
+                        help=f"файл с общим ключом узлов и координатора (иначе переменная {AUTHKEY_ENV})")
+    args = parser.parse_args(argv)
+
+    address = parse_address(args.listen)
+    try:
+        authkey = load_authkey(args.authkey_file)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.workers == 1:
+        serve(address, authkey)
+        return 0
+
+    if isinstance(address, tuple):
+        addresses = [(address[0], address[1] + k) for k in range(args.workers)]
+    else:
+        addresses = [f"{address}.{k}" for k in range(args.workers)]
+    processes = [Process(target=serve, args=(worker_address, authkey)) for worker_address in addresses]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
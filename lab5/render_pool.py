@@ -0,0 +1,347 @@
+import os
+import pickle
+from collections import Counter, deque
+import numpy as np
+from multiprocessing import Pool, resource_tracker, shared_memory
+from raycast import trace_pixels_np, shade_pixels_np, render_pixels_np, find_edge_pixels_np, tile_candidates_np
+from profiler import RenderProfile, activate, count
+
+TILE_SIZE = 64
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class SharedArray:
+    def __init__(self, shape, dtype, name=None):
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+    @property
+    def descriptor(self):
+        return self.shm.name, self.array.shape, self.array.dtype.str
+
+    @classmethod
+    def attach(cls, descriptor):
+        name, shape, dtype = descriptor
+        return cls(shape, dtype, name=name)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+
+def split_tiles(h_res, w_res, tile_size=TILE_SIZE):
+    return [(y0, min(y0 + tile_size, h_res), x0, min(x0 + tile_size, w_res))
+            for y0 in range(0, h_res, tile_size)
+            for x0 in range(0, w_res, tile_size)]
+
+
+# кадровый буфер и G-буфер: имя -> (число компонент, тип)
+BUFFER_LAYOUT = {
+    'frame': (3, np.float32),
+    'hit': (None, np.int32),
+    'point': (3, np.float32),
+    'normal': (3, np.float32),
+    'view_dir': (3, np.float32),
+    'shadow': (None, np.uint32),
+}
+
+# смещения подвыборок 2x2 внутри пикселя для сглаживания границ
+SUBPIXEL_OFFSETS = np.array([[-0.25, -0.25], [-0.25, 0.25], [0.25, -0.25], [0.25, 0.25]])
+
+# состояние процесса-исполнителя: сцена текущего рендера и подключенные буферы
+_worker_scene = {'name': None, 'payload': None}
+_worker_buffers = {}
+
+
+def _load_scene(descriptor):
+    if _worker_scene['name'] != descriptor[0]:
+        published = SharedArray.attach(descriptor)
+        _worker_scene['payload'] = pickle.loads(published.array.tobytes())
+        _worker_scene['name'] = descriptor[0]
+        published.close()
+    return _worker_scene['payload']
+
+
+def _attach_buffers(descriptors):
+    buffers = {}
+    for key, descriptor in descriptors.items():
+        attached = _worker_buffers.get(key)
+        if attached is None or attached.shm.name != descriptor[0]:
+            if attached is not None:
+                attached.close()
+            attached = _worker_buffers[key] = SharedArray.attach(descriptor)
+        buffers[key] = attached.array
+    return buffers
+
+
+def _release_worker_state():
+    for attached in _worker_buffers.values():
+        attached.close()
+    _worker_buffers.clear()
+    _worker_scene['name'] = None
+    _worker_scene['payload'] = None
+
+
+def run_profiled(function, task):
+    profile = RenderProfile()
+    previous = activate(profile)
+    try:
+        function(*task)
+    finally:
+        activate(previous)
+    return profile.to_dict()
+
+
+def render_tile(task):
+    return run_profiled(trace_and_shade_tile, task)
+
+
+def supersample_tile(task):
+    return run_profiled(supersample_pixels, task)
+
+
+# G-буфер: то, что сохраняется после трассировки и переиспользуется при пересчете освещения
+GBUFFER_KEYS = ('hit', 'point', 'normal', 'view_dir')
+
+
+def tile_pixels(tile, step=1, skip_step=0):
+    y0, y1, x0, x1 = tile
+    # прогрессивный проход берет каждый step-й пиксель, пропуская посчитанные проходом с шагом skip_step
+    ii, jj = np.mgrid[y0:y1:step, x0:x1:step]
+    ii, jj = ii.ravel(), jj.ravel()
+    if skip_step:
+        keep = (ii % skip_step != 0) | (jj % skip_step != 0)
+        ii, jj = ii[keep], jj[keep]
+    return ii, jj
+
+
+def pixel_candidates(payload, view_name, ii, jj):
+    # лучи пикселей проверяют только сферы, проекция которых накрывает охватывающий их прямоугольник;
+    # границы проекций расширены на пиксель, поэтому подвыборки сглаживания тоже в них попадают
+    bounds = payload.get('bounds')
+    if bounds is None or len(ii) == 0:
+        return None
+    return tile_candidates_np(bounds[view_name], ii.min(), ii.max() + 1, jj.min(), jj.max() + 1)
+
+
+def trace_and_shade_pixels(payload, view_name, ii, jj, gbuffer=None):
+    # без G-буфера пиксели трассируются заново; возвращаются все изменившиеся компоненты буферов
+    w_mm, h_mm, w_res, h_res = payload['screen']
+    scene = payload['scene']
+    outputs = {}
+
+    if gbuffer is None:
+        traced = trace_pixels_np(ii, jj, w_mm, h_mm, w_res, h_res, payload['views'][view_name], scene,
+                                 pixel_candidates(payload, view_name, ii, jj))
+        # освещение считается по значениям в точности буфера, как и при повторном использовании G-буфера
+        gbuffer = {key: value.astype(BUFFER_LAYOUT[key][1]) for key, value in zip(GBUFFER_KEYS, traced)}
+        outputs.update(gbuffer)
+
+    shadow_mask = np.zeros(len(ii), dtype=np.uint32)
+    outputs['frame'] = shade_pixels_np(gbuffer['hit'].astype(np.intp),
+                                       gbuffer['point'].astype(np.float64),
+                                       gbuffer['normal'].astype(np.float64),
+                                       gbuffer['view_dir'].astype(np.float64),
+                                       scene, shadow_mask, *payload['shading'])
+    outputs['shadow'] = shadow_mask
+    return outputs
+
+
+def supersample_colors(payload, view_name, ii, jj):
+    w_mm, h_mm, w_res, h_res = payload['screen']
+
+    # цвет граничного пикселя заменяется средним по четырем подвыборкам
+    sub_i = (ii[:, None] + SUBPIXEL_OFFSETS[:, 0]).ravel()
+    sub_j = (jj[:, None] + SUBPIXEL_OFFSETS[:, 1]).ravel()
+    colors = render_pixels_np(sub_i, sub_j, w_mm, h_mm, w_res, h_res, payload['views'][view_name], payload['scene'],
+                              pixel_candidates(payload, view_name, ii, jj), *payload['shading'])
+    count('aa_pixels', len(ii))
+    return colors.reshape(len(ii), len(SUBPIXEL_OFFSETS), 3).mean(axis=1)
+
+
+def render_row_colors(payload, view_name, rows):
+    y0, y1 = rows
+    w_mm, h_mm, w_res, h_res = payload['screen']
+    ii, jj = np.mgrid[y0:y1, 0:w_res]
+    ii, jj = ii.ravel(), jj.ravel()
+    colors = render_pixels_np(ii, jj, w_mm, h_mm, w_res, h_res, payload['views'][view_name], payload['scene'],
+                              pixel_candidates(payload, view_name, ii, jj), *payload['shading'])
+    return colors.reshape(y1 - y0, w_res, 3)
+
+
+def trace_and_shade_tile(scene_descriptor, descriptors, view_index, view_name, tile, retrace, step=1, skip_step=0):
+    payload = _load_scene(scene_descriptor)
+    buffers = _attach_buffers(descriptors)
+    ii, jj = tile_pixels(tile, step, skip_step)
+    region = (view_index, ii, jj)
+
+    gbuffer = None if retrace else {key: buffers[key][region] for key in GBUFFER_KEYS}
+    for key, value in trace_and_shade_pixels(payload, view_name, ii, jj, gbuffer).items():
+        buffers[key][region] = value
+
+
+def supersample_pixels(scene_descriptor, descriptors, view_index, view_name, ii, jj):
+    payload = _load_scene(scene_descriptor)
+    buffers = _attach_buffers(descriptors)
+    buffers['frame'][view_index, ii, jj] = supersample_colors(payload, view_name, ii, jj)
+
+
+def render_rows(scene_descriptor, view_index, view_name, path, rows):
+    payload = _load_scene(scene_descriptor)
+    # полоса строк рендерится целиком в памяти и сразу записывается в отображаемый файл
+    write_rows(path, rows, render_row_colors(payload, view_name, rows))
+
+
+def write_rows(path, rows, colors):
+    y0, y1 = rows
+    output = np.load(path, mmap_mode='r+')
+    output[y0:y1] = colors
+    output.flush()
+    del output
+
+
+def render_rows_task(task):
+    return run_profiled(render_rows, task)
+
+
+class RenderPool:
+    def __init__(self, processes=None, tile_size=TILE_SIZE):
+        # processes=0: плитки рендерятся в текущем процессе (например, внутри другого пула)
+        self.processes = os.cpu_count() if processes is None else processes
+        self.tile_size = tile_size
+        self.pool = None
+        self.scene = None
+        self.buffers = {}
+
+    def start(self):
+        if self.pool is None and self.processes > 0:
+            # общий трекер для всех процессов: иначе каждый исполнитель запустит свой
+            # и при завершении удалит еще используемые блоки разделяемой памяти
+            resource_tracker.ensure_running()
+            self.pool = Pool(processes=self.processes)
+
+    def publish(self, payload):
+        data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        self.release_scene()
+        self.scene = SharedArray((len(data),), np.uint8)
+        self.scene.array[:] = np.frombuffer(data, dtype=np.uint8)
+
+    def release_scene(self):
+        if self.scene is not None:
+            self.scene.unlink()
+            self.scene = None
+
+    def allocate(self, view_count, h_res, w_res):
+        reallocated = False
+        for key, (channels, dtype) in BUFFER_LAYOUT.items():
+            shape = (view_count, h_res, w_res) + ((channels,) if channels else ())
+            buffer = self.buffers.get(key)
+            if buffer is None or buffer.array.shape != shape:
+                if buffer is not None:
+                    buffer.unlink()
+                self.buffers[key] = SharedArray(shape, dtype)
+                reallocated = True
+        return reallocated
+
+    def render_views(self, view_names, h_res, w_res, retrace=True, dirty_tiles=None, profile=None,
+                     cancel=None, on_view=None, step=1, skip_step=0):
+        self.start()
+        if self.allocate(len(view_names), h_res, w_res):
+            retrace = True
+            dirty_tiles = None
+
+        if dirty_tiles is None:
+            # на грубых проходах плитки крупнее, чтобы число пикселей в задаче оставалось прежним
+            tiles = split_tiles(h_res, w_res, self.tile_size * step)
+            dirty_tiles = [(view_index, tile) for view_index in range(len(view_names)) for tile in tiles]
+
+        descriptors = {key: buffer.descriptor for key, buffer in self.buffers.items()}
+        tasks = [(self.scene.descriptor, descriptors, view_index, view_names[view_index], tile, retrace,
+                  step, skip_step)
+                 for view_index, tile in dirty_tiles]
+        return self.run_views(render_tile, tasks, len(view_names), profile, cancel, on_view)
+
+    def supersample_views(self, view_names, tiles=None, profile=None, cancel=None, on_view=None):
+        # граничные пиксели ищутся по всему буферу, чтобы учесть соседей из других плиток
+        edges = find_edge_pixels_np(self.buffers['hit'].array, self.buffers['shadow'].array)
+        h_res, w_res = edges.shape[1:]
+        if tiles is None:
+            tiles = [(view_index, tile) for view_index in range(len(view_names))
+                     for tile in split_tiles(h_res, w_res, self.tile_size * 4)]
+
+        descriptors = {key: buffer.descriptor for key, buffer in self.buffers.items()}
+        tasks = []
+        for view_index, (y0, y1, x0, x1) in tiles:
+            ii, jj = np.nonzero(edges[view_index, y0:y1, x0:x1])
+            if len(ii):
+                tasks.append((self.scene.descriptor, descriptors, view_index, view_names[view_index],
+                              ii + y0, jj + x0))
+        return self.run_views(supersample_tile, tasks, len(view_names), profile, cancel, on_view)
+
+    def run_views(self, function, tasks, view_count, profile=None, cancel=None, on_view=None):
+        frame = self.buffers['frame'].array
+
+        # вид готов, когда обработаны все его задачи; виды без задач готовы сразу
+        remaining = Counter(task[2] for task in tasks)
+        if on_view is not None:
+            for view_index in range(view_count):
+                if not remaining[view_index]:
+                    on_view(view_index, frame[view_index])
+
+        for task, tile_profile in self.run_tasks(function, tasks, cancel):
+            if profile is not None:
+                profile.merge(tile_profile)
+            view_index = task[2]
+            remaining[view_index] -= 1
+            if on_view is not None and not remaining[view_index]:
+                on_view(view_index, frame[view_index])
+        return frame
+
+    def run_tasks(self, function, tasks, cancel=None):
+        if self.pool is None:
+            for task in tasks:
+                if cancel is not None and cancel.is_set():
+                    raise RenderCancelled()
+                yield task, function(task)
+            return
+
+        # плитки подаются в пул небольшим окном, чтобы отмена не ждала всей очереди
+        pending = iter(tasks)
+        in_flight = deque()
+        while True:
+            while len(in_flight) < 2 * self.processes and not (cancel is not None and cancel.is_set()):
+                task = next(pending, None)
+                if task is None:
+                    break
+                in_flight.append((task, self.pool.apply_async(function, (task,))))
+
+            if cancel is not None and cancel.is_set():
+                # уже отправленные плитки дочитываются, прежде чем сцена будет освобождена
+                for _, result in in_flight:
+                    result.wait()
+                raise RenderCancelled()
+            if not in_flight:
+                return
+
+            task, result = in_flight.popleft()
+            yield task, result.get()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        else:
+            _release_worker_state()
+        self.release_scene()
+        for buffer in self.buffers.values():
+            buffer.unlink()
+        self.buffers = {}
@@ -0,0 +1,70 @@
+import queue
+import threading
+from render_pool import RenderCancelled
+
+
+class BackgroundRenderer:
+    def __init__(self, renderer, progressive=True):
+        self.renderer = renderer
+        self.progressive = progressive
+        self.results = queue.Queue()
+        self.condition = threading.Condition()
+        self.request = None
+        self.request_id = 0
+        self.cancel = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, screen_p, scene, **options):
+        # выигрывает последний запрос: текущий рендер прерывается на границе плиток
+        with self.condition:
+            self.request_id += 1
+            self.request = (self.request_id, screen_p, scene, options)
+            self.cancel.set()
+            self.condition.notify()
+        return self.request_id
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.request is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                request_id, screen_p, scene, options = self.request
+                self.request = None
+                self.cancel.clear()
+
+            def on_view(view_name, image):
+                self.results.put(('view', request_id, view_name, image))
+
+            try:
+                images, view_images = self.renderer.render(screen_p, scene, cancel=self.cancel, on_view=on_view,
+                                                           progressive=self.progressive, **options)
+            except RenderCancelled:
+                continue
+            except Exception as e:
+                self.results.put(('error', request_id, e))
+                continue
+            self.results.put(('done', request_id, images, view_images, self.renderer.profile,
+                              self.renderer.copy_radiance()))
+
+    def poll(self):
+        # результаты забираются из потока Tk; устаревшие запросы отбрасываются
+        messages = []
+        while True:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                return messages
+            if message[1] == self.request_id:
+                messages.append(message)
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.cancel.set()
+            self.condition.notify()
+        self.thread.join()
+        self.renderer.close()
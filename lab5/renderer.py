@@ -1,21 +1,160 @@
 
-import os
+import hashlib
+import time
 import numpy as np
-from PIL import Image, ImageTk
-from multiprocessing import Pool
+from PIL import Image
+from raycast import (norm_np, project_sphere_bounds_np, project_views_np, ray_sphere_intersect_np, SHADOW_EPSILON,
+                     REFLECTION_DEPTH, REFLECTION_THRESHOLD, cone_overlap_np)
+from bvh import SphereBVH
+from render_pool import RenderPool, split_tiles
+from render_farm import FarmPool
+from profiler import RenderProfile, stage
+from scene import SPHERE_ARRAYS, LIGHT_ARRAYS
+
+# шаги прогрессивных проходов: 1/8, 1/4, 1/2 и полное разрешение
+PROGRESSIVE_STEPS = (8, 4, 2, 1)
+
 
 class RendererComponent:
-    def render(self, screen_p, spheres, lights):
+    def __init__(self, processes=None, cache=None, farm=None, farm_key=None):
+        # farm — адреса узлов render_farm: плитки считаются на них вместо локального пула, farm_key — общий ключ
+        self.pool = FarmPool(farm, farm_key) if farm else RenderPool(processes)
+        self.cache = cache
+        self.cached_radiance = None
+        self.geometry_key = None
+        self.camera_key = None
+        self.previous_scene = None
+        self.antialias = False
+        self.shading = None
+        self.view_names = []
+        self.profile = None
+
+    def render(self, screen_p, scene, view_names=None, cancel=None, on_view=None, progressive=False,
+               antialias=False, views=None, max_depth=REFLECTION_DEPTH, min_weight=REFLECTION_THRESHOLD,
+               light_samples=0):
+        # light_samples > 0 — эталонная полутень по стратифицированным выборкам вместо аналитической
+        profile = RenderProfile()
+        start = time.perf_counter()
+
         w_mm = screen_p['w_mm']
         h_mm = screen_p['h_mm']
         w_res = int(screen_p['w_res'])
         h_res = int(screen_p['h_res'])
-        zo = screen_p['zo']
+        # views задает произвольные камеры (например, для анимации) вместо четырех стандартных видов
+        if views is None:
+            views = self.compute_views(screen_p, scene, view_names)
 
-        if spheres:
-            scene_center = np.mean([s['center'] for s in spheres], axis=0)
-        else:
-            scene_center = np.array([0, 0, 0])
+        view_images = {}
+        images = {}
+        screen = (w_mm, h_mm, w_res, h_res)
+
+        # результат с теми же сценой, экраном и видами берется из дискового кэша без трассировки;
+        # буферы пула при этом не меняются и остаются согласованными с последним настоящим рендером
+        cache_key = None
+        if self.cache is not None:
+            with stage('cache', profile):
+                cache_key = self.cache.compute_key(scene, screen, views, {'antialias': antialias,
+                                                                          'max_depth': max_depth,
+                                                                          'min_weight': min_weight,
+                                                                          'light_samples': light_samples})
+                radiance = self.cache.load(cache_key)
+            if radiance is not None and list(radiance) == list(views):
+                profile.count('cache_hits')
+                for view_name, view_frame in radiance.items():
+                    images[view_name] = self.to_image(view_frame, profile)
+                    if on_view is not None:
+                        on_view(view_name, images[view_name])
+                self.cached_radiance = radiance
+                profile.wall_time = time.perf_counter() - start
+                self.profile = profile
+                return images, dict(images)
+            profile.count('cache_misses')
+
+        with stage('scene', profile):
+            scene = scene.copy()
+            scene.bvh = SphereBVH(scene.centers, scene.radii)
+            bounds = project_views_np(views, screen, scene.centers, scene.radii)
+            shading = (max_depth, min_weight, light_samples)
+            self.pool.publish({'scene': scene, 'views': views, 'screen': screen, 'bounds': bounds,
+                               'shading': shading})
+
+        view_names = list(views)
+        camera_key = self.compute_camera_key(views, screen)
+        geometry_key = self.compute_geometry_key(scene, camera_key)
+
+        # при изменении только источников света G-буфер переиспользуется и пересчитывается лишь освещение,
+        # при изменении одной сферы перерисовываются только затронутые ею плитки
+        retrace = geometry_key != self.geometry_key
+        dirty_tiles = self.find_dirty_tiles(scene, views, screen, camera_key, antialias)
+        # отражения зависят от всей сцены: правка одной сферы меняет пиксели далеко от ее проекции
+        reflective = max_depth > 0 and (scene.refl.any() or
+                                        (self.previous_scene is not None and self.previous_scene.refl.any()))
+        if antialias != self.antialias or shading != self.shading or reflective:
+            dirty_tiles = None
+        self.geometry_key = None
+        self.previous_scene = None
+
+        def finish_view(view_index, view_frame, step=1, final=True):
+            view_name = view_names[view_index]
+            pil_image = self.to_image(view_frame[::step, ::step], profile)
+            if final:
+                images[view_name] = pil_image
+                view_images[view_name] = pil_image
+            if on_view is not None:
+                on_view(view_name, pil_image)
+
+        # прогрессивный режим: каждый проход добавляет пиксели к уже посчитанным,
+        # промежуточные проходы показываются в уменьшенном разрешении
+        steps = PROGRESSIVE_STEPS if progressive and dirty_tiles is None else (1,)
+        skip_step = 0
+        # при отмене буферы заполнены частично, поэтому ключи остаются сброшенными
+        try:
+            with stage('tiles', profile):
+                for step in steps:
+                    final = step == 1 and not antialias
+                    self.pool.render_views(view_names, h_res, w_res, retrace, dirty_tiles, profile, cancel,
+                                           lambda view_index, view_frame: finish_view(view_index, view_frame,
+                                                                                      step, final),
+                                           step, skip_step)
+                    skip_step = step
+                # сглаживание: дополнительные лучи только для пикселей на границах сфер и теней
+                if antialias:
+                    self.pool.supersample_views(view_names, dirty_tiles, profile, cancel, finish_view)
+        finally:
+            self.pool.release_scene()
+        self.geometry_key = geometry_key
+        self.camera_key = camera_key
+        self.previous_scene = scene
+        self.antialias = antialias
+        self.shading = shading
+        self.view_names = view_names
+        self.cached_radiance = None
+        if cache_key is not None:
+            with stage('cache', profile):
+                self.cache.store(cache_key, self.copy_radiance())
+
+        images = {view_name: images[view_name] for view_name in view_names}
+        view_images = {view_name: view_images[view_name] for view_name in view_names}
+        profile.wall_time = time.perf_counter() - start
+        self.profile = profile
+        return images, view_images
+
+    def to_image(self, view_frame, profile=None):
+        with stage('normalize', profile):
+            image = self.normalize_image(view_frame)
+        with stage('pil', profile):
+            return Image.fromarray(image)
+
+    def copy_radiance(self):
+        # линейная яркость последнего рендера до нормировки, по копии на вид
+        if self.cached_radiance is not None:
+            return {view_name: radiance.copy() for view_name, radiance in self.cached_radiance.items()}
+        frame = self.pool.buffers['frame'].array
+        return {view_name: frame[view_index].copy() for view_index, view_name in enumerate(self.view_names)}
+
+    def compute_views(self, screen_p, scene, view_names=None):
+        zo = screen_p['zo']
+        scene_center = scene.center()
 
         views = {
             'front': {'eye': scene_center + np.array([0, 0, zo]), 'sx': np.array([1, 0, 0]), 'sy': np.array([0, 1, 0]), 'sc': scene_center},
@@ -24,45 +163,109 @@ class RendererComponent:
             'side2': {'eye': scene_center + np.array([-zo, 0, 0]), 'sx': np.array([0, 0, -1]), 'sy': np.array([0, 1, 0]), 'sc': scene_center}
         }
 
-        view_images = {}
-        images = {}
-        
+        if view_names is not None:
+            views = {view_name: views[view_name] for view_name in view_names}
+        return views
+
+    def compute_camera_key(self, views, screen):
+        digest = hashlib.sha1()
+        digest.update(repr(screen).encode())
         for view_name, view in views.items():
-            image = self.render_view(w_mm, h_mm, w_res, h_res, view, spheres, lights)
-            pil_image = Image.fromarray(image)
-            images[view_name] = pil_image
-            view_images[view_name] = pil_image
-            
-        return images, view_images
+            digest.update(view_name.encode())
+            for key in ('eye', 'sx', 'sy', 'sc'):
+                digest.update(np.asarray(view[key], dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def compute_geometry_key(self, scene, camera_key):
+        digest = hashlib.sha1(camera_key.encode())
+        digest.update(np.ascontiguousarray(scene.centers).tobytes())
+        digest.update(np.ascontiguousarray(scene.radii).tobytes())
+        return digest.hexdigest()
+
+    def find_dirty_tiles(self, scene, views, screen, camera_key, antialias=False):
+        previous = self.previous_scene
+
+        # в пустой сцене обновлять нечего, а сравнение массивов формы (0, ...) не работает
+        if (previous is None or camera_key != self.camera_key or previous.sphere_count != scene.sphere_count
+                or scene.sphere_count == 0):
+            return None
+
+        if not all(np.array_equal(getattr(previous, name), getattr(scene, name)) for name in LIGHT_ARRAYS):
+            return None
+
+        changed = np.zeros(scene.sphere_count, dtype=bool)
+        for name in SPHERE_ARRAYS:
+            changed |= (getattr(previous, name) != getattr(scene, name)).reshape(len(changed), -1).any(axis=1)
+        changed = np.flatnonzero(changed)
 
-    def render_view(self, w_mm, h_mm, w_res, h_res, view, spheres, lights):
-        image = np.zeros((h_res, w_res, 3), dtype=np.float32)
-        eye = view['eye']
-        sx = view['sx']
-        sy = view['sy']
-        sc = view['sc']
+        if len(changed) > 1:
+            return None
+
+        w_mm, h_mm, w_res, h_res = screen
+        hit = self.pool.buffers['hit'].array
+        dirty = np.zeros(hit.shape, dtype=bool)
 
-        pixel_w = w_mm / w_res
-        pixel_h = h_mm / h_res
+        for k in changed:
+            dirty |= hit == k
+            old = (previous.centers[k], previous.radii[k])
+            new = (scene.centers[k], scene.radii[k])
 
-        args = [(i, j, eye, sx, sy, sc, pixel_w, pixel_h, w_res, h_res, spheres, lights) for i in range(h_res) for j in range(w_res)]
+            if np.array_equal(old[0], new[0]) and old[1] == new[1]:
+                continue
 
-        num_processes = os.cpu_count()
-        chunksize = max(1, len(args) // num_processes)
+            for center, radius in (old, new):
+                for view_index, view in enumerate(views.values()):
+                    i0, i1, j0, j1 = project_sphere_bounds_np(view, w_mm, h_mm, w_res, h_res,
+                                                              center[None], [radius])[0]
+                    dirty[view_index, i0:i1, j0:j1] = True
+                dirty |= self.find_shadow_region(center, radius, scene.light_pos, scene.light_radius)
 
-        with Pool(processes=num_processes) as pool:
-            results = pool.starmap(self.compute_pixel, args, chunksize=chunksize)
+        if antialias:
+            # подвыборки соседнего пикселя могут попасть на измененную сферу или ее тень,
+            # поэтому при сглаживании область расширяется на пиксель во все стороны
+            grown = dirty.copy()
+            grown[:, 1:] |= dirty[:, :-1]
+            grown[:, :-1] |= dirty[:, 1:]
+            dirty = grown.copy()
+            dirty[:, :, 1:] |= grown[:, :, :-1]
+            dirty[:, :, :-1] |= grown[:, :, 1:]
 
-        idx = 0
-        for i in range(h_res):
-            for j in range(w_res):
-                image[i, j] = results[idx]
-                idx += 1
+        return [(view_index, (y0, y1, x0, x1))
+                for view_index in range(len(views))
+                for y0, y1, x0, x1 in split_tiles(h_res, w_res, self.pool.tile_size)
+                if dirty[view_index, y0:y1, x0:x1].any()]
 
-        image = self.normalize_image(image)
-        return image
+    def find_shadow_region(self, center, radius, light_positions, light_radii):
+        hit = self.pool.buffers['hit'].array
+        surface = hit >= 0
+        region = np.zeros(hit.shape, dtype=bool)
+        origin = (self.pool.buffers['point'].array[surface].astype(np.float64)
+                  + self.pool.buffers['normal'].array[surface] * SHADOW_EPSILON)
+        shadowed = np.zeros(len(origin), dtype=bool)
 
-    def compute_pixel(self, i, j, eye, sx, sy, sc, pixel_w, pixel_h, w_res, h_res, spheres, lights):
+        for light_pos, light_radius in zip(light_positions, light_radii):
+            light_dir = light_pos - origin
+            dist = norm_np(light_dir)
+            light_dir /= np.maximum(dist, 1e-12)[:, None]
+            # полутень протяженного источника лежит не дальше его радиуса от луча к центру
+            t = ray_sphere_intersect_np(origin, light_dir, center[None],
+                                        np.array([radius + light_radius + SHADOW_EPSILON]))[:, 0]
+            shadowed |= (t > 0) & (t < dist)
+
+        region[surface] = shadowed
+        return region
+
+    def invalidate(self):
+        self.geometry_key = None
+        self.camera_key = None
+        self.previous_scene = None
+
+    def close(self):
+        self.pool.close()
+        self.invalidate()
+
+    def compute_pixel(self, i, j, eye, sx, sy, sc, pixel_w, pixel_h, w_res, h_res, spheres, lights, max_depth=0,
+                      min_weight=REFLECTION_THRESHOLD):
         ray_dir = self.compute_ray_direction(i, j, w_res, h_res, pixel_w, pixel_h, sc, sx, sy, eye)
         
         if ray_dir is None:
@@ -75,10 +278,29 @@ class RendererComponent:
             sphere = spheres[hit_sphere_idx]
             normal = (hit_point - sphere['center']) / sphere['radius']
             view_dir = -ray_dir
-            return self.compute_lighting(hit_point, normal, view_dir, sphere, lights, spheres, hit_sphere_idx)
+            color = self.compute_lighting(hit_point, normal, view_dir, sphere, lights, spheres, hit_sphere_idx)
+            return color + self.compute_reflection(hit_point, normal, view_dir, sphere['refl'], spheres, lights,
+                                                   max_depth, min_weight)
         
         return np.zeros(3)
 
+    def compute_reflection(self, hit_point, normal, view_dir, weight, spheres, lights, depth, min_weight):
+        if depth == 0 or weight <= min_weight:
+            return np.zeros(3)
+
+        ray_dir = 2 * np.dot(normal, view_dir) * normal - view_dir
+        origin = hit_point + normal * SHADOW_EPSILON
+        hit_sphere_idx, min_t = self.find_closest_intersection(origin, ray_dir, spheres)
+        if hit_sphere_idx is None:
+            return np.zeros(3)
+
+        hit_point = origin + min_t * ray_dir
+        sphere = spheres[hit_sphere_idx]
+        normal = (hit_point - sphere['center']) / sphere['radius']
+        color = weight * self.compute_lighting(hit_point, normal, -ray_dir, sphere, lights, spheres, hit_sphere_idx)
+        return color + self.compute_reflection(hit_point, normal, -ray_dir, weight * sphere['refl'], spheres, lights,
+                                               depth - 1, min_weight)
+
     def compute_ray_direction(self, i, j, w_res, h_res, pixel_w, pixel_h, sc, sx, sy, eye):
         px = (j - w_res / 2 + 0.5) * pixel_w
         py = -(i - h_res / 2 + 0.5) * pixel_h
@@ -128,8 +350,34 @@ class RendererComponent:
         return color
 
     def compute_visibility_and_direction(self, hit_point, normal, light, spheres, hit_sphere_idx):
+        if light['radius'] > 0:
+            return self.compute_area_light_visibility(hit_point, normal, light, spheres, hit_sphere_idx)
         return self.compute_point_light_visibility(hit_point, normal, light, spheres, hit_sphere_idx)
 
+    def compute_area_light_visibility(self, hit_point, normal, light, spheres, hit_sphere_idx):
+        light_dir = light['pos'] - hit_point
+        dist = np.linalg.norm(light_dir)
+
+        if dist == 0:
+            return 0, None, 0
+
+        light_dir /= dist
+        shadow_origin = hit_point + normal * SHADOW_EPSILON
+        alpha = np.arcsin(min(light['radius'] / dist, 1))
+
+        visibility = 1.0
+        for other_idx, other in enumerate(spheres):
+            oc = other['center'] - shadow_origin
+            other_dist = np.linalg.norm(oc)
+            t = np.dot(oc, light_dir)
+            if other_idx == hit_sphere_idx or t <= 0 or other_dist >= dist:
+                continue
+            beta = np.arcsin(min(other['radius'] / other_dist, 1))
+            gamma = np.arccos(np.clip(t / other_dist, -1, 1))
+            visibility *= 1 - float(cone_overlap_np(alpha, beta, gamma))
+
+        return visibility, light_dir, dist
+
     def compute_point_light_visibility(self, hit_point, normal, light, spheres, hit_sphere_idx):
         light_dir = light['pos'] - hit_point
         dist = np.linalg.norm(light_dir)
@@ -150,8 +398,9 @@ class RendererComponent:
         
         return visibility, light_dir, dist
 
-    def normalize_image(self, image):
-        max_val = np.max(image)
+    def normalize_image(self, image, max_val=None):
+        if max_val is None:
+            max_val = np.max(image)
 
         if max_val > 0:
             image = (image / max_val * 255).astype(np.uint8)
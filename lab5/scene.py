@@ -0,0 +1,83 @@
+import numpy as np
+
+SPHERE_ARRAYS = ('centers', 'radii', 'colors', 'kd', 'ks', 'shin', 'refl')
+LIGHT_ARRAYS = ('light_pos', 'light_color', 'light_i0', 'light_radius')
+
+
+class Scene:
+    def __init__(self, centers, radii, colors, kd, ks, shin, light_pos, light_color, light_i0, refl=None,
+                 light_radius=None):
+        self.centers = np.ascontiguousarray(centers, dtype=np.float32).reshape(-1, 3)
+        self.radii = np.ascontiguousarray(radii, dtype=np.float32).reshape(-1)
+        self.colors = np.ascontiguousarray(colors, dtype=np.float32).reshape(-1, 3)
+        self.kd = np.ascontiguousarray(kd, dtype=np.float32).reshape(-1)
+        self.ks = np.ascontiguousarray(ks, dtype=np.float32).reshape(-1)
+        self.shin = np.ascontiguousarray(shin, dtype=np.float32).reshape(-1)
+        # доля зеркально отраженного света, 0 — без отражений
+        self.refl = np.zeros(len(self.radii), dtype=np.float32) if refl is None else \
+            np.ascontiguousarray(refl, dtype=np.float32).reshape(-1)
+        self.light_pos = np.ascontiguousarray(light_pos, dtype=np.float32).reshape(-1, 3)
+        self.light_color = np.ascontiguousarray(light_color, dtype=np.float32).reshape(-1, 3)
+        self.light_i0 = np.ascontiguousarray(light_i0, dtype=np.float32).reshape(-1)
+        # радиус сферического источника, 0 — точечный источник с резкой тенью
+        self.light_radius = np.zeros(len(self.light_i0), dtype=np.float32) if light_radius is None else \
+            np.ascontiguousarray(light_radius, dtype=np.float32).reshape(-1)
+        self.bvh = None
+
+        for name in SPHERE_ARRAYS:
+            if len(getattr(self, name)) != len(self.centers):
+                raise ValueError(f"{name}: ожидается {len(self.centers)} значений")
+        for name in LIGHT_ARRAYS:
+            if len(getattr(self, name)) != len(self.light_pos):
+                raise ValueError(f"{name}: ожидается {len(self.light_pos)} значений")
+
+    @classmethod
+    def from_dicts(cls, spheres, lights):
+        return cls(
+            centers=[s['center'] for s in spheres],
+            radii=[s['radius'] for s in spheres],
+            colors=[s['color'] for s in spheres],
+            kd=[s['kd'] for s in spheres],
+            ks=[s['ks'] for s in spheres],
+            shin=[s['shin'] for s in spheres],
+            refl=[s.get('refl', 0.0) for s in spheres],
+            light_pos=[l['pos'] for l in lights],
+            light_color=[l['color'] for l in lights],
+            light_i0=[l['i0'] for l in lights],
+            light_radius=[l.get('radius', 0.0) for l in lights],
+        )
+
+    @property
+    def sphere_count(self):
+        return len(self.radii)
+
+    @property
+    def light_count(self):
+        return len(self.light_i0)
+
+    def center(self):
+        if self.sphere_count == 0:
+            return np.zeros(3)
+        return self.centers.mean(axis=0, dtype=np.float64)
+
+    def copy(self):
+        return Scene(**{name: getattr(self, name).copy() for name in SPHERE_ARRAYS + LIGHT_ARRAYS})
+
+    def sphere_dicts(self):
+        return [{
+            'center': self.centers[i].astype(np.float64),
+            'radius': float(self.radii[i]),
+            'color': self.colors[i].astype(np.float64),
+            'kd': float(self.kd[i]),
+            'ks': float(self.ks[i]),
+            'shin': float(self.shin[i]),
+            'refl': float(self.refl[i])
+        } for i in range(self.sphere_count)]
+
+    def light_dicts(self):
+        return [{
+            'pos': self.light_pos[i].astype(np.float64),
+            'color': self.light_color[i].astype(np.float64),
+            'i0': float(self.light_i0[i]),
+            'radius': float(self.light_radius[i])
+        } for i in range(self.light_count)]
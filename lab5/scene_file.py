@@ -0,0 +1,86 @@
+import json
+import numpy as np
+from scene import Scene
+
+SCREEN_KEYS = ('w_mm', 'h_mm', 'w_res', 'h_res', 'zo')
+
+SPHERE_DEFAULTS = {'color': [1.0, 1.0, 1.0], 'kd': 0.8, 'ks': 0.5, 'shin': 32.0, 'refl': 0.0}
+LIGHT_DEFAULTS = {'color': [1.0, 1.0, 1.0], 'i0': 10000.0, 'radius': 0.0}
+
+
+def read_vector(data, key):
+    value = np.array(data[key], dtype=np.float64)
+    if value.shape != (3,):
+        raise ValueError(f"{key}: ожидается 3 числа, получено {data[key]!r}")
+    return value
+
+
+def write_vector(value):
+    # float32 -> кратчайшая десятичная запись, чтобы 0.8 не превращалось в 0.800000011920929
+    return [float(str(v)) for v in np.asarray(value, dtype=np.float32)]
+
+
+def parse_scene(data):
+    try:
+        screen_p = {key: float(data['screen'][key]) for key in SCREEN_KEYS}
+
+        spheres = []
+        for sphere in data.get('spheres', []):
+            sphere = {**SPHERE_DEFAULTS, **sphere}
+            spheres.append({
+                'center': read_vector(sphere, 'center'),
+                'radius': float(sphere['radius']),
+                'color': read_vector(sphere, 'color'),
+                'kd': float(sphere['kd']),
+                'ks': float(sphere['ks']),
+                'shin': float(sphere['shin']),
+                'refl': float(sphere['refl'])
+            })
+
+        lights = []
+        for light in data.get('lights', []):
+            light = {**LIGHT_DEFAULTS, **light}
+            lights.append({
+                'pos': read_vector(light, 'pos'),
+                'color': read_vector(light, 'color'),
+                'i0': float(light['i0']),
+                'radius': float(light['radius'])
+            })
+    except KeyError as e:
+        raise ValueError(f"отсутствует поле {e}") from None
+    except TypeError as e:
+        raise ValueError(str(e)) from None
+
+    return screen_p, Scene.from_dicts(spheres, lights)
+
+
+def dump_scene(screen_p, scene):
+    return {
+        'screen': {key: screen_p[key] for key in SCREEN_KEYS},
+        'spheres': [{
+            'center': write_vector(center),
+            'radius': float(str(radius)),
+            'color': write_vector(color),
+            'kd': float(str(kd)),
+            'ks': float(str(ks)),
+            'shin': float(str(shin)),
+            'refl': float(str(refl))
+        } for center, radius, color, kd, ks, shin, refl in
+            zip(scene.centers, scene.radii, scene.colors, scene.kd, scene.ks, scene.shin, scene.refl)],
+        'lights': [{
+            'pos': write_vector(pos),
+            'color': write_vector(color),
+            'i0': float(str(i0)),
+            'radius': float(str(radius))
+        } for pos, color, i0, radius in zip(scene.light_pos, scene.light_color, scene.light_i0, scene.light_radius)]
+    }
+
+
+def load_scene(path):
+    with open(path, encoding='utf-8') as f:
+        return parse_scene(json.load(f))
+
+
+def save_scene(path, screen_p, scene):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dump_scene(screen_p, scene), f, ensure_ascii=False, indent=2)
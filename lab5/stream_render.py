@@ -0,0 +1,101 @@
+import os
+import struct
+import time
+import zlib
+import numpy as np
+from bvh import SphereBVH
+from raycast import project_views_np, REFLECTION_DEPTH, REFLECTION_THRESHOLD
+from profiler import RenderProfile, stage
+from render_pool import render_rows_task
+
+# оценка рабочей памяти на один луч: массивы лучей, обход BVH, освещение
+BYTES_PER_RAY = 1024
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def write_png_rows(path, width, height, bands):
+    # PNG пишется полосами строк, целиком изображение в памяти не хранится
+    compressor = zlib.compressobj(6)
+    with open(path, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        for band in bands:
+            rows = np.zeros((len(band), width * 3 + 1), dtype=np.uint8)
+            rows[:, 1:] = band.reshape(len(band), -1)
+            data = compressor.compress(rows.tobytes())
+            if data:
+                f.write(png_chunk(b'IDAT', data))
+        f.write(png_chunk(b'IDAT', compressor.flush()))
+        f.write(png_chunk(b'IEND', b''))
+
+
+def read_rows(path, y0, y1):
+    # отображение открывается на каждую полосу, чтобы прочитанные страницы не накапливались в памяти процесса
+    radiance = np.load(path, mmap_mode='r')
+    rows = np.array(radiance[y0:y1])
+    del radiance
+    return rows
+
+
+def rows_per_chunk(w_res, memory_budget, workers):
+    return max(1, memory_budget // (max(1, workers) * w_res * BYTES_PER_RAY))
+
+
+def render_streaming(renderer, screen_p, scene, out_dir, stem, memory_budget=DEFAULT_MEMORY_BUDGET, view_names=None,
+                     keep_hdr=False, max_depth=REFLECTION_DEPTH, min_weight=REFLECTION_THRESHOLD, light_samples=0):
+    profile = RenderProfile()
+    start = time.perf_counter()
+
+    w_res = int(screen_p['w_res'])
+    h_res = int(screen_p['h_res'])
+    screen = (screen_p['w_mm'], screen_p['h_mm'], w_res, h_res)
+    views = renderer.compute_views(screen_p, scene, view_names)
+    pool = renderer.pool
+
+    with stage('scene', profile):
+        scene = scene.copy()
+        scene.bvh = SphereBVH(scene.centers, scene.radii)
+        bounds = project_views_np(views, screen, scene.centers, scene.radii)
+        pool.publish({'scene': scene, 'views': views, 'screen': screen, 'bounds': bounds,
+                      'shading': (max_depth, min_weight, light_samples)})
+    pool.start()
+
+    # полосы строк подбираются так, чтобы все исполнители вместе укладывались в бюджет памяти
+    rows = rows_per_chunk(w_res, memory_budget, pool.processes)
+    bands = [(y0, min(y0 + rows, h_res)) for y0 in range(0, h_res, rows)]
+    paths = {view_name: os.path.join(out_dir, f"{stem}_{view_name}.npy") for view_name in views}
+
+    try:
+        with stage('tiles', profile):
+            # файлы .npy создаются заранее, исполнители дописывают в них свои полосы
+            for path in paths.values():
+                np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(h_res, w_res, 3)).flush()
+            tasks = [(pool.scene.descriptor, view_index, view_name, paths[view_name], band)
+                     for view_index, view_name in enumerate(views) for band in bands]
+            for _, tile_profile in pool.run_tasks(render_rows_task, tasks):
+                profile.merge(tile_profile)
+    finally:
+        pool.release_scene()
+
+    written = []
+    for view_name, path in paths.items():
+        with stage('normalize', profile):
+            max_val = max(read_rows(path, y0, y1).max() for y0, y1 in bands)
+        png_path = os.path.join(out_dir, f"{stem}_{view_name}.png")
+        with stage('png', profile):
+            write_png_rows(png_path, w_res, h_res,
+                           (renderer.normalize_image(read_rows(path, y0, y1), max_val) for y0, y1 in bands))
+        written.append(png_path)
+        if keep_hdr:
+            written.append(path)
+        else:
+            os.remove(path)
+
+    profile.wall_time = time.perf_counter() - start
+    renderer.profile = profile
+    return written
@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+import numpy as np
+from PIL import Image
+from stream_render import read_rows, write_png_rows
+
+# строк на полосу при тональной коррекции файлов, не помещающихся в память
+TONEMAP_ROWS = 256
+
+
+def radiance_max(radiances):
+    # одна нормировка на все виды, чтобы их яркости были сравнимы
+    return max((float(np.max(radiance)) for radiance in radiances), default=0.0)
+
+
+def tonemap(radiance, white, exposure=0.0):
+    # экспозиция в ступенях: +1 вдвое ярче; white — значение, отображаемое в 255 при нулевой экспозиции
+    scale = np.float32(255 * 2.0 ** exposure / white) if white > 0 else np.float32(0)
+    return np.clip(radiance * scale, 0, 255).astype(np.uint8)
+
+
+def tonemap_images(radiances, exposure=0.0, white=None):
+    if white is None:
+        white = radiance_max(radiances.values())
+    return {view_name: Image.fromarray(tonemap(radiance, white, exposure))
+            for view_name, radiance in radiances.items()}
+
+
+def save_radiance(path, radiance):
+    target = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=radiance.shape)
+    target[:] = radiance
+    target.flush()
+    del target
+
+
+def load_radiance(path):
+    return np.load(path, mmap_mode='r')
+
+
+def tonemap_files(paths, out_dir, exposure=0.0, rows=TONEMAP_ROWS):
+    # файлы читаются полосами: сначала общий максимум по всем видам, затем запись PNG
+    shapes = [load_radiance(path).shape for path in paths]
+    white = max((float(read_rows(path, y0, y0 + rows).max())
+                 for path, shape in zip(paths, shapes) for y0 in range(0, shape[0], rows)), default=0.0)
+
+    written = []
+    for path, (h_res, w_res, _) in zip(paths, shapes):
+        png_path = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + '.png')
+        write_png_rows(png_path, w_res, h_res,
+                       (tonemap(read_rows(path, y0, y0 + rows), white, exposure) for y0 in range(0, h_res, rows)))
+        written.append(png_path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Тональная коррекция сохраненных HDR-буферов (.npy) без повторного рендера")
+    parser.add_argument('radiance', nargs='+', help="файлы .npy с яркостью видов")
+    parser.add_argument('-e', '--exposure', type=float, default=0.0, help="экспозиция в ступенях")
+    parser.add_argument('-o', '--output', default='.', help="каталог для PNG")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    for path in tonemap_files(args.radiance, args.output, args.exposure):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())